@@ -0,0 +1,85 @@
+"""
+Times crop_bottom_and_right_black_border against the pixel walking loop it
+replaced, on a noisy panorama with a black border.
+
+    uv run python benchmarks/crop_border.py
+"""
+
+import random
+import timeit
+from functools import partial
+
+from PIL import Image
+
+from streetview.tools import (
+    BLACK_LUMINANCE,
+    crop_bottom_and_right_black_border,
+    get_pixel_from_bw_image,
+)
+
+
+def make_panorama(width: int, height: int) -> Image.Image:
+    random.seed(0)
+    noise = Image.frombytes(
+        "RGB", (width, height), random.randbytes(width * height * 3)
+    )
+    panorama = Image.new("RGB", (width, height))
+    panorama.paste(noise.crop((0, 0, width * 7 // 8, height * 13 // 16)))
+    return panorama
+
+
+def pixel_loop_crop(img: Image.Image) -> Image.Image:
+    """
+    The original pixel walking search, which converts the image to greyscale
+    for every pixel it looks at.
+    """
+    width, height = img.size
+    bw_img = img.convert("L")
+
+    def get_pixel(x: int, y: int) -> float:
+        return get_pixel_from_bw_image(img, x, y)
+
+    def all_black(box: tuple[int, int, int, int]) -> bool:
+        return all(p <= BLACK_LUMINANCE for p in bw_img.crop(box).tobytes())
+
+    cursor = (0, height - 1)
+    valid_max_y = height - 1
+    while cursor[0] < width and cursor[1] >= 0:
+        if get_pixel(*cursor) > BLACK_LUMINANCE:
+            if all_black((0, cursor[1] + 1, width, height)):
+                valid_max_y = cursor[1]
+                break
+            cursor = (cursor[0] + 1, height - 1)
+        else:
+            cursor = (cursor[0], cursor[1] - 1)
+
+    cursor = (width - 1, 0)
+    valid_max_x = width - 1
+    while cursor[1] < height and cursor[0] >= 0:
+        if get_pixel(*cursor) > BLACK_LUMINANCE:
+            if all_black((cursor[0] + 1, 0, width, height)):
+                valid_max_x = cursor[0]
+                break
+            cursor = (width - 1, cursor[1] + 1)
+        else:
+            cursor = (cursor[0] - 1, cursor[1])
+
+    return img.crop((0, 0, valid_max_x + 1, valid_max_y + 1))
+
+
+def main() -> None:
+    for zoom in (1, 2):
+        panorama = make_panorama(2**zoom * 512, 2 ** (zoom - 1) * 512)
+        assert pixel_loop_crop(panorama).size == (
+            crop_bottom_and_right_black_border(panorama).size
+        )
+        for name, crop in {
+            "pixel loop": pixel_loop_crop,
+            "crop_bottom_and_right_black_border": crop_bottom_and_right_black_border,
+        }.items():
+            seconds = min(timeit.repeat(partial(crop, panorama), number=1, repeat=3))
+            print(f"zoom {zoom} {name:<36} {seconds * 1e3:10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
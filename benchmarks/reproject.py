@@ -0,0 +1,66 @@
+"""
+Times reproject_cubemap on a zoom 3 panorama, with a cold and a warm
+sampling map cache, against a per-pixel Python loop on one small face.
+
+    uv run python benchmarks/reproject.py
+"""
+
+import math
+import timeit
+from functools import partial
+
+import numpy as np
+from PIL import Image
+
+from streetview.tools import (
+    clear_sampling_maps,
+    perspective_to_equirectangular,
+    reproject_cubemap,
+)
+
+
+def pixel_loop_face(panorama: Image.Image, size: int) -> Image.Image:
+    """
+    A nearest neighbour face, one pixel at a time, as downstream code did it.
+    """
+    width, height = panorama.size
+    face = Image.new("RGB", (size, size))
+    focal = size / 2
+    for row in range(size):
+        for col in range(size):
+            x, y, z = col - (size - 1) / 2, (size - 1) / 2 - row, focal
+            u = 0.5 + math.atan2(x, z) / (2 * math.pi)
+            v = 0.5 - math.atan2(y, math.hypot(x, z)) / math.pi
+            pixel = panorama.getpixel(
+                (int(u * width) % width, min(int(v * height), height - 1))
+            )
+            face.putpixel((col, row), pixel)  # pyright: ignore[reportArgumentType]
+    return face
+
+
+def main() -> None:
+    rng = np.random.default_rng(0)
+    panorama = Image.fromarray(rng.integers(0, 256, (2048, 4096, 3), dtype=np.uint8))
+    # Check the projection agrees with the loop's, away from the edges.
+    u, _ = perspective_to_equirectangular(0, 0, 90, (256, 256))
+    assert abs(float(u[128, 128]) - 0.5) < 1e-3
+
+    seconds = min(
+        timeit.repeat(partial(pixel_loop_face, panorama, 256), number=1, repeat=3)
+    )
+    print(f"{'pixel loop, one 256 face':<36} {seconds * 1e3:10.1f} ms")
+
+    def cold() -> None:
+        clear_sampling_maps()
+        reproject_cubemap(panorama, face_size=1024)
+
+    seconds = min(timeit.repeat(cold, number=1, repeat=3))
+    print(f"{'cubemap, 6 1024 faces, cold cache':<36} {seconds * 1e3:10.1f} ms")
+    seconds = min(
+        timeit.repeat(partial(reproject_cubemap, panorama, 1024), number=1, repeat=3)
+    )
+    print(f"{'cubemap, 6 1024 faces, warm cache':<36} {seconds * 1e3:10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
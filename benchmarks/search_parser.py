@@ -0,0 +1,85 @@
+"""
+Times parsing the search responses recorded in tests/cassettes.
+
+    uv run python benchmarks/search_parser.py
+"""
+
+import json
+import re
+import timeit
+from pathlib import Path
+
+import yaml
+
+from streetview.search import (
+    Panorama,
+    extract_panorama_tuples,
+    extract_panoramas,
+)
+
+CASSETTES = Path(__file__).parent.parent / "tests" / "cassettes"
+
+
+def load_payloads() -> list[str]:
+    payloads = []
+    for path in sorted(CASSETTES.glob("*.yaml")):
+        for interaction in yaml.safe_load(path.read_text())["interactions"]:
+            body = interaction["response"]["body"]["string"]
+            if isinstance(body, str) and "callbackfunc( " in body:
+                payloads.append(body)
+    return payloads
+
+
+def regex_extract_panoramas(text: str) -> list[Panorama]:
+    """
+    The parser before it sliced the callback out of the response.
+    """
+    blob = re.findall(r"callbackfunc\( (.*) \)$", text)[0]
+    data = json.loads(blob)
+    if data == [[5, "generic", "Search returned no images."]]:
+        return []
+    subset = data[1][5][0]
+    raw_panos = subset[3][0][::-1]
+    raw_dates = [] if (len(subset) < 9 or subset[8] is None) else subset[8]
+    dates = [f"{d[1][0]}-{d[1][1]:02d}" for d in raw_dates[::-1]]
+    return [
+        Panorama(
+            pano_id=pano[0][1],
+            lat=pano[2][0][2],
+            lon=pano[2][0][3],
+            heading=pano[2][2][0],
+            pitch=pano[2][2][1] if len(pano[2][2]) >= 2 else None,
+            roll=pano[2][2][2] if len(pano[2][2]) >= 3 else None,
+            date=dates[i] if i < len(dates) else None,
+            elevation=pano[3][0] if len(pano) >= 4 else None,
+        )
+        for i, pano in enumerate(raw_panos)
+    ]
+
+
+def main() -> None:
+    payloads = load_payloads()
+    encoded = [payload.encode() for payload in payloads]
+    print(f"{len(payloads)} search responses")
+
+    parsers = {
+        "regex + json + validation": lambda: [
+            regex_extract_panoramas(p) for p in payloads
+        ],
+        "extract_panoramas": lambda: [extract_panoramas(p) for p in encoded],
+        "Panorama.model_construct": lambda: [
+            [Panorama.model_construct(**row._asdict()) for row in rows]
+            for rows in map(extract_panorama_tuples, encoded)
+        ],
+        "extract_panorama_tuples": lambda: [
+            extract_panorama_tuples(p) for p in encoded
+        ],
+    }
+    for name, parse in parsers.items():
+        runs = 200
+        seconds = min(timeit.repeat(parse, number=runs, repeat=5)) / runs
+        print(f"{name:<36} {seconds * 1e3:8.3f} ms per pass")
+
+
+if __name__ == "__main__":
+    main()
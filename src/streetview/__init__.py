@@ -1,8 +1,27 @@
 from .api import get_panorama_meta, get_streetview  # noqa
-from .download import get_panorama, get_panorama_async  # noqa
+from .area import search_area  # noqa
+from .client import StreetViewClient  # noqa
+from .download import (  # noqa
+    download_panoramas,
+    export_pyramid,
+    export_tiles,
+    get_panorama,
+    get_panorama_array,
+    get_panorama_array_async,
+    get_panorama_async,
+    save_panorama,
+    save_panorama_async,
+)
+from .pipeline import save_panoramas_async  # noqa
+from .retry import RetryPolicy  # noqa
 from .search import (  # noqa
     search_panoramas,
+    search_panoramas_async,
+    search_panoramas_many,
     search_panoramas_url,
+    search_panoramas_url_async,
     search_panoramas_url_exact,
+    search_panoramas_url_exact_async,
 )
 from .tools import crop_bottom_and_right_black_border  # noqa
+from .view import get_panorama_view, get_panorama_view_async  # noqa
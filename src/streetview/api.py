@@ -4,6 +4,10 @@ import requests
 from PIL import Image
 from pydantic import BaseModel
 
+from .client import get_session
+from .ratelimit import throttle
+from .singleflight import coalesce
+
 
 class Location(BaseModel):
     lat: float
@@ -17,9 +21,12 @@ class MetaData(BaseModel):
     copyright: str
 
 
-def get_panorama_meta(pano_id: str, api_key: str) -> MetaData:
+def get_panorama_meta(
+    pano_id: str, api_key: str, session: requests.Session | None = None
+) -> MetaData:
     """
-    Returns a panorama's metadata.
+    Returns a panorama's metadata. Threads asking for the same panorama's
+    metadata at the same time share one request.
 
     Quota: This function doesn't use up any quota or charge on your API_KEY.
 
@@ -30,8 +37,14 @@ def get_panorama_meta(pano_id: str, api_key: str) -> MetaData:
         "https://maps.googleapis.com/maps/api/streetview/metadata"
         f"?pano={pano_id}&key={api_key}"
     )
-    resp = requests.get(url)
-    return MetaData(**resp.json())
+    session = session or get_session()
+
+    def get() -> MetaData:
+        throttle(url)
+        resp = session.get(url)
+        return MetaData(**resp.json())
+
+    return coalesce(url, get)
 
 
 def get_streetview(
@@ -42,6 +55,7 @@ def get_streetview(
     heading: int = 0,
     fov: int = 120,
     pitch: int = 0,
+    session: requests.Session | None = None,
 ) -> Image.Image:
     """
     Get an image using the official API. These are not panoramas.
@@ -60,6 +74,8 @@ def get_streetview(
         height (int): Image height (max 640 for non-premium downloads).
         fov (int): Image field-of-view.
         pitch (int): Image pitch.
+        session (requests.Session): Session to send the request with. Defaults
+            to the shared session from `streetview.client.get_session`.
     """
 
     url = "https://maps.googleapis.com/maps/api/streetview"
@@ -72,6 +88,8 @@ def get_streetview(
         "key": api_key,
     }
 
-    response = requests.get(url, params=params, stream=True)
+    session = session or get_session()
+    throttle(url)
+    response = session.get(url, params=params, stream=True)
     img = Image.open(BytesIO(response.content))
     return img
@@ -0,0 +1,199 @@
+import concurrent.futures
+import math
+from collections.abc import Generator, Sequence
+from dataclasses import dataclass
+from typing import cast
+
+import requests
+
+from .client import get_session
+from .search import Panorama, extract_panoramas, search_request
+
+# (min_lat, min_lon, max_lat, max_lon)
+BBox = tuple[float, float, float, float]
+# [(lat, lon), ...]
+Polygon = Sequence[tuple[float, float]]
+
+METRES_PER_DEGREE = 111_320
+DEFAULT_SPACING = 50
+DEFAULT_REFINEMENTS = 2
+DEFAULT_CONCURRENCY = 8
+
+
+@dataclass
+class Cell:
+    lat: float
+    lon: float
+    # Half the cell's height and width in degrees.
+    half_lat: float
+    half_lon: float
+    level: int
+
+    def corners(self) -> list[tuple[float, float]]:
+        return [
+            (self.lat + dlat, self.lon + dlon)
+            for dlat in (-self.half_lat, self.half_lat)
+            for dlon in (-self.half_lon, self.half_lon)
+        ]
+
+    def contains(self, lat: float, lon: float) -> bool:
+        return (
+            abs(lat - self.lat) <= self.half_lat
+            and abs(lon - self.lon) <= self.half_lon
+        )
+
+    def split(self) -> list["Cell"]:
+        half_lat = self.half_lat / 2
+        half_lon = self.half_lon / 2
+        return [
+            Cell(self.lat + dlat, self.lon + dlon, half_lat, half_lon, self.level - 1)
+            for dlat in (-half_lat, half_lat)
+            for dlon in (-half_lon, half_lon)
+        ]
+
+
+def to_polygon(area: BBox | Polygon) -> list[tuple[float, float]]:
+    """
+    Returns the vertices of an area given as a bounding box or a polygon.
+    """
+    if isinstance(area[0], int | float):
+        min_lat, min_lon, max_lat, max_lon = cast(BBox, area)
+        return [
+            (min_lat, min_lon),
+            (min_lat, max_lon),
+            (max_lat, max_lon),
+            (max_lat, min_lon),
+        ]
+    return list(cast(Polygon, area))
+
+
+def point_in_polygon(lat: float, lon: float, polygon: Polygon) -> bool:
+    """
+    Returns whether a point is inside a polygon, by ray casting.
+    """
+    inside = False
+    for (lat1, lon1), (lat2, lon2) in zip(
+        polygon, [*polygon[1:], polygon[0]], strict=True
+    ):
+        if (lat1 > lat) != (lat2 > lat):
+            crossing = lon1 + (lat - lat1) / (lat2 - lat1) * (lon2 - lon1)
+            if lon < crossing:
+                inside = not inside
+    return inside
+
+
+def cell_overlaps_polygon(cell: Cell, polygon: Polygon) -> bool:
+    """
+    Returns whether any part of a cell might be inside a polygon.
+    """
+    points = [(cell.lat, cell.lon), *cell.corners()]
+    return any(point_in_polygon(lat, lon, polygon) for lat, lon in points) or any(
+        cell.contains(lat, lon) for lat, lon in polygon
+    )
+
+
+def layout_grid(polygon: Polygon, step: float, level: int = 0) -> list[Cell]:
+    """
+    Covers a polygon's bounding box with square cells `step` metres wide.
+    """
+    lats = [lat for lat, _ in polygon]
+    lons = [lon for _, lon in polygon]
+    min_lat, max_lat, min_lon, max_lon = min(lats), max(lats), min(lons), max(lons)
+
+    lat_step = step / METRES_PER_DEGREE
+    mid_lat = math.radians((min_lat + max_lat) / 2)
+    lon_step = step / (METRES_PER_DEGREE * math.cos(mid_lat))
+
+    rows = max(1, math.ceil((max_lat - min_lat) / lat_step))
+    cols = max(1, math.ceil((max_lon - min_lon) / lon_step))
+    return [
+        Cell(
+            lat=min_lat + (row + 0.5) * lat_step,
+            lon=min_lon + (col + 0.5) * lon_step,
+            half_lat=lat_step / 2,
+            half_lon=lon_step / 2,
+            level=level,
+        )
+        for row in range(rows)
+        for col in range(cols)
+    ]
+
+
+def search_cell(cell: Cell, session: requests.Session | None = None) -> list[Panorama]:
+    """
+    Searches for panoramas anywhere in a cell, with a radius that reaches its
+    corners.
+    """
+    half_height = cell.half_lat * METRES_PER_DEGREE
+    half_width = cell.half_lon * METRES_PER_DEGREE * math.cos(math.radians(cell.lat))
+    radius = math.ceil(math.hypot(half_height, half_width))
+    resp = search_request(cell.lat, cell.lon, session, radius)
+    return extract_panoramas(resp.content)
+
+
+def search_area(
+    area: BBox | Polygon,
+    spacing: float = DEFAULT_SPACING,
+    refinements: int = DEFAULT_REFINEMENTS,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    session: requests.Session | None = None,
+) -> Generator[Panorama, None, None]:
+    """
+    Finds the panoramas inside an area, given as a bounding box
+    `(min_lat, min_lon, max_lat, max_lon)` or a polygon of `(lat, lon)` points.
+
+    The area is first searched on a coarse grid `spacing * 2**refinements`
+    metres wide. Cells that turn up panoramas are split in four and searched
+    again, down to cells `spacing` metres wide, so empty regions only cost one
+    coarse search. Searches run on `concurrency` threads and each panorama is
+    yielded once, as soon as it is found.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    polygon = to_polygon(area)
+    session = session or get_session()
+
+    cells = layout_grid(polygon, spacing * 2**refinements, refinements)
+    queue = [cell for cell in cells if cell_overlaps_polygon(cell, polygon)]
+
+    seen: set[str] = set()
+    pending: dict[concurrent.futures.Future[list[Panorama]], Cell] = {}
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+    try:
+
+        def submit_queued() -> None:
+            while queue and len(pending) < 2 * concurrency:
+                cell = queue.pop()
+                pending[executor.submit(search_cell, cell, session)] = cell
+
+        submit_queued()
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                cell = pending.pop(future)
+                panos = future.result()
+
+                if panos and cell.level > 0:
+                    queue.extend(
+                        child
+                        for child in cell.split()
+                        if cell_overlaps_polygon(child, polygon)
+                    )
+
+                for pano in panos:
+                    if pano.pano_id in seen:
+                        continue
+                    if not point_in_polygon(pano.lat, pano.lon, polygon):
+                        continue
+                    seen.add(pano.pano_id)
+                    yield pano
+
+            submit_queued()
+    finally:
+        # If the caller stops early, drop the queued searches rather than
+        # run them all.
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,329 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections.abc import Callable, Coroutine
+from pathlib import Path
+from typing import IO, Any, cast
+
+from PIL import Image
+
+from .singleflight import AsyncSingleFlight, SingleFlight
+
+# 2 GB is room for a few hundred zoom 5 panoramas.
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+# Evict down to this fraction of the cap so that a full cache doesn't rescan
+# the directory on every write.
+EVICTION_TARGET = 0.9
+
+# Lossless, so a stored panorama comes back exactly as it was downloaded.
+DEFAULT_STORE_FORMAT = "png"
+DEFAULT_STORE_QUALITY = 95
+
+
+def write_atomically(path: Path, data: bytes) -> None:
+    """
+    Writes `data` to `path` through a temporary file in the same directory, so
+    readers in other threads or processes never see a partly written file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+class HashingWriter:
+    """
+    A write-only file that hashes what is written to it. It has no `fileno`,
+    so PIL writes encoded images through `write` rather than to the file
+    descriptor directly.
+    """
+
+    def __init__(self, file: IO[bytes]):
+        self.file = file
+        self.hash = hashlib.sha256()
+
+    def write(self, data: bytes) -> int:
+        self.hash.update(data)
+        return self.file.write(data)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+
+class TileCache:
+    """
+    An on-disk cache of the raw JPEG bytes of panorama tiles, keyed by
+    `(pano_id, zoom, x, y)`.
+
+    Panoramas never change, so cached tiles never go stale. Once the cache
+    grows past `max_bytes` the least recently used tiles are deleted. Pass
+    `max_bytes=None` for an unbounded cache.
+
+    Several threads or processes can share a directory: tiles are written
+    atomically and a tile deleted by someone else is treated as a miss.
+    """
+
+    def __init__(
+        self, directory: str | os.PathLike, max_bytes: int | None = DEFAULT_MAX_BYTES
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size: int | None = None
+
+    def path(self, pano_id: str, zoom: int, x: int, y: int) -> Path:
+        """
+        Returns where a tile is stored.
+        """
+        return self.directory / pano_id / str(zoom) / f"{x}_{y}.jpg"
+
+    def get(self, pano_id: str, zoom: int, x: int, y: int) -> bytes | None:
+        """
+        Returns a tile's bytes, or `None` if it isn't cached.
+        """
+        path = self.path(pano_id, zoom, x, y)
+        try:
+            data = path.read_bytes()
+            # The modification time doubles as the last access time for LRU.
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, pano_id: str, zoom: int, x: int, y: int, data: bytes) -> None:
+        """
+        Stores a tile's bytes, evicting old tiles if the cache is full.
+        """
+        write_atomically(self.path(pano_id, zoom, x, y), data)
+
+        if self.max_bytes is None:
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._scan())
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict(int(self.max_bytes * EVICTION_TARGET))
+
+    def remove(self, pano_id: str, zoom: int) -> None:
+        """
+        Deletes all of a panorama's tiles at a zoom level.
+        """
+        shutil.rmtree(self.directory / pano_id / str(zoom), ignore_errors=True)
+        # Tidy up the panorama's directory if that was its last zoom level.
+        with contextlib.suppress(OSError):
+            (self.directory / pano_id).rmdir()
+        with self._lock:
+            self._size = None
+
+    def _scan(self) -> list[tuple[float, Path, int]]:
+        entries = []
+        for path in self.directory.glob("*/*/*.jpg"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def _evict(self, target_bytes: int) -> None:
+        # Rescan rather than trust self._size, other processes may have
+        # written or evicted tiles too.
+        entries = sorted(self._scan())
+        size = sum(size for _, _, size in entries)
+        for _, path, file_size in entries:
+            if size <= target_bytes:
+                break
+            path.unlink(missing_ok=True)
+            size -= file_size
+        self._size = size
+
+
+class PanoramaStore:
+    """
+    A local store of whole panoramas, keyed by `(pano_id, zoom)`, so batch
+    jobs can skip panoramas that are already done.
+
+    Images are saved in `format`, lossless PNG by default, under the SHA-256
+    of their bytes, so identical panoramas are only stored once, and written
+    atomically before they are added to a SQLite manifest. A crash never
+    leaves a half written panorama behind, and several processes can share a
+    directory. A JPEG store takes less space but returns re-encoded pixels.
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike,
+        format: str = DEFAULT_STORE_FORMAT,
+        quality: int = DEFAULT_STORE_QUALITY,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.format = format
+        self.quality = quality
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        self._async_flights = AsyncSingleFlight()
+        self._db = sqlite3.connect(
+            self.directory / "manifest.sqlite", check_same_thread=False
+        )
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS panoramas ("
+                "pano_id TEXT, zoom INTEGER, digest TEXT, suffix TEXT, created REAL,"
+                "PRIMARY KEY (pano_id, zoom))"
+            )
+
+    def _object_path(self, digest: str, suffix: str) -> Path:
+        return self.directory / "objects" / digest[:2] / f"{digest}{suffix}"
+
+    def path(self, pano_id: str, zoom: int) -> Path | None:
+        """
+        Returns where a panorama's image is, or `None` if it isn't stored.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest, suffix FROM panoramas WHERE pano_id=? AND zoom=?",
+                (pano_id, zoom),
+            ).fetchone()
+        if row is None:
+            return None
+        return self._object_path(*row)
+
+    def has(self, pano_id: str, zoom: int) -> bool:
+        """
+        Returns whether a panorama is stored.
+        """
+        path = self.path(pano_id, zoom)
+        return path is not None and path.exists()
+
+    def get(self, pano_id: str, zoom: int) -> Image.Image | None:
+        """
+        Returns a stored panorama, or `None` if it isn't stored.
+        """
+        path = self.path(pano_id, zoom)
+        if path is None:
+            return None
+        # The store only holds panoramas it wrote itself. Open them with the
+        # format's own reader, as `Image.open` takes a zoom 5 panorama for a
+        # decompression bomb.
+        Image.init()
+        factory, _ = Image.OPEN[Image.registered_extensions()[path.suffix]]
+        try:
+            with path.open("rb") as f, factory(f, str(path)) as image:
+                image.load()
+        except FileNotFoundError:
+            return None
+        return image
+
+    def put(self, pano_id: str, zoom: int, image: Image.Image) -> Path:
+        """
+        Stores a panorama and returns where its image is.
+        """
+        # Encode straight into a temporary file, hashing as it goes, rather
+        # than hold the encoded panorama in memory.
+        objects = self.directory / "objects"
+        objects.mkdir(exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=objects, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                writer = HashingWriter(f)
+                image.save(cast(IO[bytes], writer), self.format, quality=self.quality)
+            digest = writer.hash.hexdigest()
+            suffix = f".{self.format.lower()}"
+            path = self._object_path(digest, suffix)
+            if path.exists():
+                Path(tmp_path).unlink()
+            else:
+                path.parent.mkdir(exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        with self._lock, self._db:
+            old = self._db.execute(
+                "SELECT digest, suffix FROM panoramas WHERE pano_id=? AND zoom=?",
+                (pano_id, zoom),
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO panoramas VALUES (?, ?, ?, ?, ?)",
+                (pano_id, zoom, digest, suffix, time.time()),
+            )
+            if old is not None and old != (digest, suffix):
+                self._remove_unused(*old)
+        return path
+
+    def get_or_put(
+        self, pano_id: str, zoom: int, make: Callable[[], Image.Image]
+    ) -> Image.Image:
+        """
+        Returns a stored panorama, or makes it with `make()` and stores it.
+        Concurrent calls for the same panorama are coalesced: one of them
+        makes it and the others share it.
+        """
+        image = self.get(pano_id, zoom)
+        if image is not None:
+            return image
+
+        def get_or_make() -> Image.Image:
+            # Another call may have stored it since we looked.
+            image = self.get(pano_id, zoom)
+            if image is None:
+                image = make()
+                self.put(pano_id, zoom, image)
+            return image
+
+        return self._flights.do((pano_id, zoom), get_or_make)
+
+    async def get_or_put_async(
+        self,
+        pano_id: str,
+        zoom: int,
+        make: Callable[[], Coroutine[Any, Any, Image.Image]],
+    ) -> Image.Image:
+        """
+        Like `get_or_put`, for a coroutine `make`. Concurrent calls on an
+        event loop are coalesced.
+        """
+        # The store does blocking IO, keep it off the event loop.
+        image = await asyncio.to_thread(self.get, pano_id, zoom)
+        if image is not None:
+            return image
+
+        async def get_or_make() -> Image.Image:
+            image = await asyncio.to_thread(self.get, pano_id, zoom)
+            if image is None:
+                image = await make()
+                await asyncio.to_thread(self.put, pano_id, zoom, image)
+            return image
+
+        return await self._async_flights.do((pano_id, zoom), get_or_make)
+
+    def close(self) -> None:
+        """
+        Closes the manifest.
+        """
+        self._db.close()
+
+    def _remove_unused(self, digest: str, suffix: str) -> None:
+        (count,) = self._db.execute(
+            "SELECT COUNT(*) FROM panoramas WHERE digest=? AND suffix=?",
+            (digest, suffix),
+        ).fetchone()
+        if count == 0:
+            self._object_path(digest, suffix).unlink(missing_ok=True)
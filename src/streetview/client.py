@@ -0,0 +1,114 @@
+import asyncio
+import importlib.util
+import threading
+import weakref
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+# Enough connections for every worker of a default ThreadPoolExecutor to keep
+# its own connection alive.
+DEFAULT_POOL_SIZE = 32
+DEFAULT_TIMEOUT = 30.0
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+# One default async client per event loop, as an httpx client can't be shared
+# between loops.
+_async_clients: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, httpx.AsyncClient
+] = weakref.WeakKeyDictionary()
+
+
+def make_session(pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """
+    Returns a `requests.Session` that keeps up to `pool_size` connections per
+    host alive between requests.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the session shared by every function that isn't given one. It is
+    created on first use.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+        return _session
+
+
+def set_session(session: requests.Session | None) -> None:
+    """
+    Replaces the shared session, e.g. with one from `make_session` using a
+    bigger pool. Pass `None` to go back to the default session.
+    """
+    global _session
+    with _session_lock:
+        _session = session
+
+
+class StreetViewClient(httpx.AsyncClient):
+    """
+    An `httpx.AsyncClient` set up for Street View: a connection pool sized for
+    concurrent tile downloads, a request timeout and HTTP/2 when the `h2`
+    package is installed. Use it as an async context manager and pass it to
+    the async functions so they share its connections:
+
+        async with StreetViewClient() as client:
+            image = await get_panorama_async(pano_id, zoom=5, client=client)
+    """
+
+    def __init__(
+        self,
+        max_connections: int = DEFAULT_POOL_SIZE,
+        max_keepalive_connections: int | None = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        http2: bool | None = None,
+        **kwargs,
+    ):
+        if max_keepalive_connections is None:
+            max_keepalive_connections = max_connections
+        if http2 is None:
+            http2 = importlib.util.find_spec("h2") is not None
+
+        super().__init__(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+            timeout=timeout,
+            http2=http2,
+            **kwargs,
+        )
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Returns the client used by async functions that aren't given one. Each
+    event loop gets its own client, created on first use.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = StreetViewClient()
+        _async_clients[loop] = client
+    return client
+
+
+async def close_async_client() -> None:
+    """
+    Closes the current event loop's default client. A new one is created if
+    it's needed again.
+    """
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,97 @@
+import math
+import threading
+
+DEFAULT_INITIAL = 4
+DEFAULT_MINIMUM = 1
+DEFAULT_MAXIMUM = 32
+DEFAULT_DECREASE = 0.5
+# A request this many times slower than the fastest one seen is a sign of
+# congestion, most likely because it was throttled and retried.
+DEFAULT_LATENCY_TOLERANCE = 3.0
+# How far the latency baseline moves towards each slower response, so it
+# follows the network when it gets slower for good.
+DEFAULT_BASELINE_DECAY = 0.05
+
+
+class AdaptiveConcurrency:
+    """
+    Picks how many requests to keep in flight, the way TCP picks its
+    congestion window: additive increase, multiplicative decrease (AIMD).
+
+    Every healthy response adds `1 / limit` to the limit, so it grows by
+    about one per round of requests. A retry, an error, or a response more
+    than `latency_tolerance` times slower than the baseline cuts it by
+    `decrease`. It only cuts once per round, as the requests that were
+    already in flight when the trouble started will fail or slow down too.
+
+    The baseline is the fastest response seen, but every slower response
+    pulls it `baseline_decay` of the way towards itself, so one lucky
+    response doesn't make everything after it look congested.
+
+    `limit` is the current concurrency, read it to see how fast the server
+    lets you go. Reusing a controller between downloads keeps what it learnt.
+    """
+
+    def __init__(
+        self,
+        initial: int = DEFAULT_INITIAL,
+        minimum: int = DEFAULT_MINIMUM,
+        maximum: int = DEFAULT_MAXIMUM,
+        decrease: float = DEFAULT_DECREASE,
+        latency_tolerance: float = DEFAULT_LATENCY_TOLERANCE,
+        baseline_decay: float = DEFAULT_BASELINE_DECAY,
+    ):
+        if not 1 <= minimum <= initial <= maximum:
+            raise ValueError("need 1 <= minimum <= initial <= maximum")
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1")
+        if not 0 <= baseline_decay <= 1:
+            raise ValueError("baseline_decay must be between 0 and 1")
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.baseline_decay = baseline_decay
+        self._window = float(initial)
+        self._baseline = math.inf
+        # Responses since the last cut, to cut at most once per round.
+        self._since_decrease = math.inf
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        """
+        How many requests may be in flight right now.
+        """
+        return int(self._window)
+
+    def record_success(self, latency: float) -> None:
+        """
+        Feeds back a response that took `latency` seconds.
+        """
+        with self._lock:
+            slow = latency > self._baseline * self.latency_tolerance
+            if latency < self._baseline:
+                self._baseline = latency
+            else:
+                self._baseline += self.baseline_decay * (latency - self._baseline)
+            if slow:
+                self._cut()
+                return
+            self._since_decrease += 1
+            self._window = min(self.maximum, self._window + 1 / self._window)
+
+    def record_failure(self) -> None:
+        """
+        Feeds back a request that failed or has to be retried, e.g. because
+        it was throttled.
+        """
+        with self._lock:
+            self._cut()
+
+    def _cut(self) -> None:
+        if self._since_decrease < self._window:
+            self._since_decrease += 1
+            return
+        self._window = max(self.minimum, self._window * self.decrease)
+        self._since_decrease = 0
@@ -1,19 +1,40 @@
 import asyncio
 import concurrent.futures
+import contextlib
 import itertools
+import math
+import mmap
+import os
 import time
-from collections.abc import AsyncGenerator, Generator
+import zipfile
+from collections.abc import AsyncGenerator, Callable, Generator, Iterable
 from dataclasses import dataclass
 from io import BytesIO
+from pathlib import Path
+from typing import TYPE_CHECKING
 
 import httpx
 import requests
 from PIL import Image
 
-async_client = httpx.AsyncClient()
+from .cache import PanoramaStore, TileCache
+from .client import get_async_client, get_session
+from .concurrency import AdaptiveConcurrency
+from .ratelimit import throttle, throttle_async
+from .retry import DEFAULT_MAX_RETRIES, RetryPolicy
+from .singleflight import coalesce, coalesce_async
+from .tools import get_non_black_bbox
 
+# NumPy is optional, it's only needed for the get_panorama_array functions.
+if TYPE_CHECKING:
+    import numpy as np  # pyright: ignore[reportMissingImports]
 
-DEFAULT_MAX_RETRIES = 6
+DEFAULT_CONCURRENCY = 16
+TILE_SIZE = 512
+MIN_ZOOM = 1
+# The reductions a JPEG can be decoded at by PIL's draft mode.
+DRAFT_SCALES = (8, 4, 2, 1)
+DEFAULT_QUALITY = 90
 
 
 @dataclass
@@ -21,6 +42,9 @@ class TileInfo:
     x: int
     y: int
     fileurl: str
+    # Only needed to look the tile up in a TileCache.
+    pano_id: str | None = None
+    zoom: int | None = None
 
 
 @dataclass
@@ -30,6 +54,13 @@ class Tile:
     image: Image.Image
 
 
+@dataclass
+class RawTile:
+    x: int
+    y: int
+    data: bytes
+
+
 def get_width_and_height_from_zoom(zoom: int) -> tuple[int, int]:
     """
     Returns the width and height of a panorama at a given zoom level, depends on the
@@ -38,6 +69,88 @@ def get_width_and_height_from_zoom(zoom: int) -> tuple[int, int]:
     return 2**zoom, 2 ** (zoom - 1)
 
 
+def get_tile_grid(zoom: int, size: tuple[int, int] | None = None) -> tuple[int, int]:
+    """
+    Returns how many tiles wide and high a panorama is. Without the
+    panorama's `size` in pixels this is the full grid of the zoom level.
+    """
+    if size is None:
+        return get_width_and_height_from_zoom(zoom)
+    width, height = size
+    return -(-width // TILE_SIZE), -(-height // TILE_SIZE)
+
+
+def new_panorama_image(
+    zoom: int, size: tuple[int, int] | None = None, scale: int = 1
+) -> Image.Image:
+    """
+    Returns a blank image big enough to hold all of a panorama's tiles, or
+    exactly `size` pixels if given, shrunk `scale` times.
+    """
+    if size is None:
+        width, height = get_width_and_height_from_zoom(zoom)
+        size = (width * TILE_SIZE, height * TILE_SIZE)
+    return Image.new("RGB", (-(-size[0] // scale), -(-size[1] // scale)))
+
+
+def panorama_width(zoom: int) -> int:
+    """
+    Returns the width in pixels of a panorama's full tile grid.
+    """
+    return get_width_and_height_from_zoom(zoom)[0] * TILE_SIZE
+
+
+def pick_zoom_and_scale(target_width: int, max_zoom: int) -> tuple[int, int]:
+    """
+    Returns the cheapest zoom level, up to `max_zoom`, and draft scale to
+    decode its tiles at for a panorama at least `target_width` pixels wide.
+
+    The lowest zoom that is wide enough has the fewest tiles to download,
+    then the biggest reduction that keeps it wide enough decodes them the
+    fastest.
+    """
+    zoom = MIN_ZOOM
+    while zoom < max_zoom and panorama_width(zoom) < target_width:
+        zoom += 1
+    width = panorama_width(zoom)
+    for scale in DRAFT_SCALES:
+        if width // scale >= target_width:
+            return zoom, scale
+    return zoom, 1
+
+
+def scale_size(size: tuple[int, int], zoom: int, to_zoom: int) -> tuple[int, int]:
+    """
+    Converts a panorama's size in pixels at `zoom` to its size at `to_zoom`.
+    """
+    factor = 2.0 ** (to_zoom - zoom)
+    return math.ceil(size[0] * factor), math.ceil(size[1] * factor)
+
+
+def draft_tile(tile: Tile, scale: int) -> Image.Image:
+    """
+    Returns a tile's image decoded at `1 / scale` of its size. JPEG's draft
+    mode skips most of the decoding work, anything else is resized.
+    """
+    if scale == 1:
+        return tile.image
+    size = (TILE_SIZE // scale, TILE_SIZE // scale)
+    tile.image.draft("RGB", size)
+    if tile.image.size != size:
+        return tile.image.resize(size, Image.Resampling.BOX)
+    return tile.image
+
+
+def resize_to_width(image: Image.Image, width: int) -> Image.Image:
+    """
+    Resizes an image to `width` pixels wide, keeping its aspect ratio.
+    """
+    if image.width == width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.Resampling.LANCZOS)
+
+
 def make_download_url(pano_id: str, zoom: int, x: int, y: int) -> str:
     """
     Returns the URL to download a tile.
@@ -50,88 +163,503 @@ def make_download_url(pano_id: str, zoom: int, x: int, y: int) -> str:
     )
 
 
+def get_cached_tile(tile_info: TileInfo, cache: TileCache | None) -> bytes | None:
+    """
+    Returns a tile's bytes from the cache, or `None` if it isn't there.
+    """
+    if cache is None or tile_info.pano_id is None or tile_info.zoom is None:
+        return None
+    return cache.get(tile_info.pano_id, tile_info.zoom, tile_info.x, tile_info.y)
+
+
+def put_cached_tile(tile_info: TileInfo, cache: TileCache | None, data: bytes) -> None:
+    """
+    Stores a tile's bytes in the cache.
+    """
+    if cache is None or tile_info.pano_id is None or tile_info.zoom is None:
+        return
+    cache.put(tile_info.pano_id, tile_info.zoom, tile_info.x, tile_info.y, data)
+
+
+def fetch_panorama_tile_bytes(
+    tile_info: TileInfo,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    session: requests.Session | None = None,
+    cache: TileCache | None = None,
+    retry: RetryPolicy | None = None,
+    on_retry: Callable[[], None] | None = None,
+) -> bytes:
+    """
+    Tries to download a tile, returns the raw JPEG bytes. If a cache is given
+    the tile is read from it when possible and stored in it otherwise.
+
+    Connection errors, timeouts and throttled or failed responses are retried
+    with exponential backoff following `retry`, by default a `RetryPolicy`
+    making up to `max_retries` tries, calling `on_retry()` before each retry.
+    Any other error response raises an `HTTPError`. Threads asking for the
+    same tile at the same time share one download. Only the thread making
+    the requests has its `on_retry` called, the others just wait.
+    """
+    data = get_cached_tile(tile_info, cache)
+    if data is not None:
+        return data
+
+    retry = retry or RetryPolicy(max_retries=max_retries)
+    session = session or get_session()
+
+    def download() -> bytes:
+        for attempt in range(retry.max_retries):
+            last_attempt = attempt == retry.max_retries - 1
+            throttle(tile_info.fileurl)
+            try:
+                response = session.get(
+                    tile_info.fileurl, stream=True, timeout=retry.timeout
+                )
+                data = response.content
+            except (requests.ConnectionError, requests.Timeout) as e:  # noqa: PERF203
+                if last_attempt:
+                    raise requests.ConnectionError("Max retries exceeded.") from e
+                delay = retry.delay(attempt)
+                print(f"Request error {e}. Trying again in {delay:.1f} seconds.")
+                if on_retry is not None:
+                    on_retry()
+                time.sleep(delay)
+                continue
+
+            if retry.should_retry(response.status_code):
+                if last_attempt:
+                    response.raise_for_status()
+                delay = retry.delay(attempt, response.headers.get("Retry-After"))
+                print(
+                    f"HTTP {response.status_code}. Trying again in {delay:.1f} seconds."
+                )
+                if on_retry is not None:
+                    on_retry()
+                time.sleep(delay)
+                continue
+
+            # An error page isn't a tile, don't let it fail later as an image.
+            response.raise_for_status()
+            return data
+        raise requests.ConnectionError("Max retries exceeded.")
+
+    data = coalesce(tile_info.fileurl, download)
+    # Every caller stores the tile in its own cache, not only the one that
+    # downloaded it.
+    put_cached_tile(tile_info, cache, data)
+    return data
+
+
 def fetch_panorama_tile(
-    tile_info: TileInfo, max_retries: int = DEFAULT_MAX_RETRIES
+    tile_info: TileInfo,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    session: requests.Session | None = None,
+    cache: TileCache | None = None,
+    retry: RetryPolicy | None = None,
 ) -> Image.Image:
     """
     Tries to download a tile, returns a PIL Image.
     """
-    for _ in range(max_retries):
-        try:
-            response = requests.get(tile_info.fileurl, stream=True)
-            return Image.open(BytesIO(response.content))
-        except requests.ConnectionError:  # noqa: PERF203
-            print("Connection error. Trying again in 2 seconds.")
-            time.sleep(2)
-    raise requests.ConnectionError("Max retries exceeded.")
+    data = fetch_panorama_tile_bytes(tile_info, max_retries, session, cache, retry)
+    return Image.open(BytesIO(data))
+
+
+async def fetch_panorama_tile_bytes_async(
+    tile_info: TileInfo,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    client: httpx.AsyncClient | None = None,
+    cache: TileCache | None = None,
+    retry: RetryPolicy | None = None,
+    on_retry: Callable[[], None] | None = None,
+) -> bytes:
+    """
+    Asynchronously tries to download a tile, returns the raw JPEG bytes. If a
+    cache is given the tile is read from it when possible and stored in it
+    otherwise. Failed requests are retried like in `fetch_panorama_tile_bytes`,
+    and tasks asking for the same tile at the same time share one download.
+    Only the task making the requests has its `on_retry` called.
+    """
+    # The cache does blocking file IO, keep it off the event loop.
+    if cache is not None:
+        data = await asyncio.to_thread(get_cached_tile, tile_info, cache)
+        if data is not None:
+            return data
+
+    retry = retry or RetryPolicy(max_retries=max_retries)
+    client = client or get_async_client()
+
+    async def download() -> bytes:
+        for attempt in range(retry.max_retries):
+            last_attempt = attempt == retry.max_retries - 1
+            await throttle_async(tile_info.fileurl)
+            try:
+                response = await client.get(tile_info.fileurl, timeout=retry.timeout)
+                data = response.content
+            except httpx.RequestError as e:  # noqa: PERF203
+                if last_attempt:
+                    raise httpx.RequestError("Max retries exceeded.") from e
+                delay = retry.delay(attempt)
+                print(f"Request error {e}. Trying again in {delay:.1f} seconds.")
+                if on_retry is not None:
+                    on_retry()
+                await asyncio.sleep(delay)
+                continue
+
+            if retry.should_retry(response.status_code):
+                if last_attempt:
+                    response.raise_for_status()
+                delay = retry.delay(attempt, response.headers.get("Retry-After"))
+                print(
+                    f"HTTP {response.status_code}. Trying again in {delay:.1f} seconds."
+                )
+                if on_retry is not None:
+                    on_retry()
+                await asyncio.sleep(delay)
+                continue
+
+            response.raise_for_status()
+            return data
+
+        raise httpx.RequestError("Max retries exceeded.")
+
+    data = await coalesce_async(tile_info.fileurl, download)
+    if cache is not None:
+        await asyncio.to_thread(put_cached_tile, tile_info, cache, data)
+    return data
 
 
 async def fetch_panorama_tile_async(
-    tile_info: TileInfo, max_retries: int = DEFAULT_MAX_RETRIES
+    tile_info: TileInfo,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    client: httpx.AsyncClient | None = None,
+    cache: TileCache | None = None,
+    retry: RetryPolicy | None = None,
 ) -> Image.Image:
     """
     Asynchronously tries to download a tile, returns a PIL Image.
     """
-    for _ in range(max_retries):
-        try:
-            response = await async_client.get(tile_info.fileurl)
-            return Image.open(BytesIO(response.content))
-
-        except httpx.RequestError as e:  # noqa: PERF203
-            print(f"Request error {e}. Trying again in 2 seconds.")
-            await asyncio.sleep(2)
-
-    raise httpx.RequestError("Max retries exceeded.")
+    data = await fetch_panorama_tile_bytes_async(
+        tile_info, max_retries, client, cache, retry
+    )
+    return Image.open(BytesIO(data))
 
 
-def iter_tile_info(pano_id: str, zoom: int) -> Generator[TileInfo, None, None]:
+def iter_tile_info(
+    pano_id: str, zoom: int, size: tuple[int, int] | None = None
+) -> Generator[TileInfo, None, None]:
     """
-    Generate a list of a panorama's tiles and their position.
+    Generate a list of a panorama's tiles and their position. If the
+    panorama's `size` in pixels is given, tiles outside of it are skipped.
     """
-    width, height = get_width_and_height_from_zoom(zoom)
+    width, height = get_tile_grid(zoom, size)
     for x, y in itertools.product(range(width), range(height)):
         yield TileInfo(
             x=x,
             y=y,
             fileurl=make_download_url(pano_id=pano_id, zoom=zoom, x=x, y=y),
+            pano_id=pano_id,
+            zoom=zoom,
         )
 
 
-def iter_tiles(
+def find_edge(
+    count: int, probe: Callable[[int], tuple[int, int, int, int] | None], side: int
+) -> int:
+    """
+    Returns where the picture ends along a row or column of `count` tiles, in
+    pixels. `probe(i)` returns the bounding box of what's in the i-th tile, or
+    `None` if it's all black. `side` picks the edge from the bounding box, 2
+    for the right and 3 for the bottom.
+    """
+    # Most panoramas fill the whole grid, so try the last tile first.
+    bbox = probe(count - 1)
+    if bbox is not None:
+        return (count - 1) * TILE_SIZE + bbox[side]
+
+    # Binary search for the last tile with something in it.
+    first, last = 0, count - 1
+    first_bbox = None
+    while last - first > 1:
+        middle = (first + last) // 2
+        bbox = probe(middle)
+        if bbox is None:
+            last = middle
+        else:
+            first, first_bbox = middle, bbox
+
+    if first_bbox is None:
+        first_bbox = probe(first)
+    if first_bbox is None:
+        # Nothing but black, don't guess.
+        return count * TILE_SIZE
+    return first * TILE_SIZE + first_bbox[side]
+
+
+def get_panorama_size(
+    pano_id: str,
+    zoom: int = 5,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    session: requests.Session | None = None,
+    cache: TileCache | None = None,
+    retry: RetryPolicy | None = None,
+) -> tuple[int, int]:
+    """
+    Finds a panorama's real width and height in pixels at a zoom level.
+
+    User-contributed panoramas often don't fill the tile grid of the zoom
+    level, the tiles past their edges come back black. This probes tiles along
+    the middle row and the first column for the last ones with something in
+    them. That's two requests for a panorama that fills the grid and a few
+    more otherwise. Pass a `cache` to reuse the probed tiles in the download.
+    """
+    grid_width, grid_height = get_width_and_height_from_zoom(zoom)
+    session = session or get_session()
+
+    def probe(x: int, y: int) -> tuple[int, int, int, int] | None:
+        info = TileInfo(
+            x=x,
+            y=y,
+            fileurl=make_download_url(pano_id=pano_id, zoom=zoom, x=x, y=y),
+            pano_id=pano_id,
+            zoom=zoom,
+        )
+        data = fetch_panorama_tile_bytes(info, max_retries, session, cache, retry)
+        return get_non_black_bbox(Image.open(BytesIO(data)))
+
+    # The middle row is the horizon, the first column rarely has black in it.
+    width = find_edge(grid_width, lambda x: probe(x, grid_height // 2), 2)
+    height = find_edge(grid_height, lambda y: probe(0, y), 3)
+    return width, height
+
+
+def open_checkpoint(checkpoint: str | os.PathLike | None) -> TileCache | None:
+    """
+    Returns the store for a download's checkpoint directory. It's a tile cache
+    without a size limit, so no tile is evicted before the download is done.
+    """
+    if checkpoint is None:
+        return None
+    return TileCache(checkpoint, max_bytes=None)
+
+
+def remove_checkpoint(
+    checkpoint: str | os.PathLike | None, pano_id: str, zoom: int
+) -> None:
+    """
+    Deletes a finished panorama's tiles from its checkpoint directory.
+    """
+    store = open_checkpoint(checkpoint)
+    if store is not None:
+        store.remove(pano_id, zoom)
+
+
+def iter_raw_tiles(
     pano_id: str,
     zoom: int,
     max_retries: int = DEFAULT_MAX_RETRIES,
     multi_threaded: bool = False,
-) -> Generator[Tile, None, None]:
+    session: requests.Session | None = None,
+    cache: TileCache | None = None,
+    checkpoint: str | os.PathLike | None = None,
+    size: tuple[int, int] | None = None,
+    retry: RetryPolicy | None = None,
+    controller: AdaptiveConcurrency | None = None,
+) -> Generator[RawTile, None, None]:
+    """
+    Downloads a panorama's tiles as the original JPEG bytes, without decoding
+    them.
+
+    With `multi_threaded=True` the number of requests in flight is adapted to
+    how the server copes, by `controller` or a new `AdaptiveConcurrency`.
+
+    With a `checkpoint` directory every tile is saved there as soon as it
+    arrives. If the download fails and is run again with the same checkpoint,
+    only the missing tiles are downloaded.
+    """
+    # All the threads share one session so their connections are reused
+    # across tiles.
+    session = session or get_session()
+    store = open_checkpoint(checkpoint)
+
+    def fetch(info: TileInfo, on_retry: Callable[[], None] | None = None) -> bytes:
+        # Runs on the worker threads, so a tile is checkpointed even if
+        # another one fails first.
+        data = get_cached_tile(info, store)
+        if data is None:
+            # Error responses raise, so only real tiles are checkpointed.
+            data = fetch_panorama_tile_bytes(
+                info, max_retries, session, cache, retry, on_retry
+            )
+            put_cached_tile(info, store, data)
+        return data
+
     if not multi_threaded:
-        for info in iter_tile_info(pano_id, zoom):
-            image = fetch_panorama_tile(info, max_retries)
-            yield Tile(x=info.x, y=info.y, image=image)
+        for info in iter_tile_info(pano_id, zoom, size):
+            yield RawTile(x=info.x, y=info.y, data=fetch(info))
         return
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_tile = {
-            executor.submit(fetch_panorama_tile, info, max_retries): info
-            for info in iter_tile_info(pano_id, zoom)
-        }
-        for future in concurrent.futures.as_completed(future_to_tile):
-            info = future_to_tile[future]
-            try:
-                image = future.result()
-            except Exception as exc:
-                msg = f"Failed to download tile {info.fileurl} due to Exception: {exc}"
-                raise Exception(msg) from exc
-            else:
-                yield Tile(x=info.x, y=info.y, image=image)
+    controller = controller or AdaptiveConcurrency()
+
+    def fetch_and_record(info: TileInfo) -> bytes:
+        # Tiles that are already on disk say nothing about the server.
+        data = get_cached_tile(info, store) or get_cached_tile(info, cache)
+        if data is not None:
+            return data
+        start = time.monotonic()
+        try:
+            # Throttled and failed attempts are congestion too, back off on
+            # each one instead of once the retries run out.
+            data = fetch(info, controller.record_failure)
+        except Exception:
+            controller.record_failure()
+            raise
+        controller.record_success(time.monotonic() - start)
+        return data
+
+    tile_infos = iter_tile_info(pano_id, zoom, size)
+    pending: dict[concurrent.futures.Future[bytes], TileInfo] = {}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=controller.maximum)
+    try:
+        while True:
+            # Only as many tiles as the controller allows are in flight, the
+            # rest wait here rather than in the executor's queue.
+            while len(pending) < controller.limit:
+                info = next(tile_infos, None)
+                if info is None:
+                    break
+                pending[executor.submit(fetch_and_record, info)] = info
+            if not pending:
+                break
+
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                info = pending.pop(future)
+                try:
+                    data = future.result()
+                except Exception as exc:
+                    msg = (
+                        f"Failed to download tile {info.fileurl} "
+                        f"due to Exception: {exc}"
+                    )
+                    raise Exception(msg) from exc
+                yield RawTile(x=info.x, y=info.y, data=data)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_tiles(
+    pano_id: str,
+    zoom: int,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    multi_threaded: bool = False,
+    session: requests.Session | None = None,
+    cache: TileCache | None = None,
+    checkpoint: str | os.PathLike | None = None,
+    size: tuple[int, int] | None = None,
+    retry: RetryPolicy | None = None,
+    controller: AdaptiveConcurrency | None = None,
+) -> Generator[Tile, None, None]:
+    for raw in iter_raw_tiles(
+        pano_id=pano_id,
+        zoom=zoom,
+        max_retries=max_retries,
+        multi_threaded=multi_threaded,
+        session=session,
+        cache=cache,
+        checkpoint=checkpoint,
+        size=size,
+        retry=retry,
+        controller=controller,
+    ):
+        yield Tile(x=raw.x, y=raw.y, image=Image.open(BytesIO(raw.data)))
+
+
+async def iter_raw_tiles_async(
+    pano_id: str,
+    zoom: int,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    client: httpx.AsyncClient | None = None,
+    cache: TileCache | None = None,
+    checkpoint: str | os.PathLike | None = None,
+    size: tuple[int, int] | None = None,
+    retry: RetryPolicy | None = None,
+) -> AsyncGenerator[RawTile, None]:
+    """
+    Asynchronously downloads a panorama's tiles as the original JPEG bytes,
+    keeping up to `concurrency` requests in flight. Tiles are yielded in the
+    order they complete.
+
+    With a `checkpoint` directory every tile is saved there as soon as it
+    arrives. If the download fails and is run again with the same checkpoint,
+    only the missing tiles are downloaded.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    client = client or get_async_client()
+    semaphore = asyncio.Semaphore(concurrency)
+    store = open_checkpoint(checkpoint)
+
+    async def fetch(info: TileInfo) -> RawTile:
+        async with semaphore:
+            data = None
+            if store is not None:
+                data = await asyncio.to_thread(get_cached_tile, info, store)
+            if data is None:
+                data = await fetch_panorama_tile_bytes_async(
+                    info, max_retries, client, cache, retry
+                )
+                if store is not None:
+                    await asyncio.to_thread(put_cached_tile, info, store, data)
+        return RawTile(x=info.x, y=info.y, data=data)
+
+    tasks = [
+        asyncio.ensure_future(fetch(info))
+        for info in iter_tile_info(pano_id, zoom, size)
+    ]
+    try:
+        for next_tile in asyncio.as_completed(tasks):
+            yield await next_tile
+    finally:
+        # Don't leave requests running if the caller stops early or a tile fails.
+        for task in tasks:
+            task.cancel()
 
 
 async def iter_tiles_async(
-    pano_id: str, zoom: int, max_retries: int = DEFAULT_MAX_RETRIES
+    pano_id: str,
+    zoom: int,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    client: httpx.AsyncClient | None = None,
+    cache: TileCache | None = None,
+    checkpoint: str | os.PathLike | None = None,
+    size: tuple[int, int] | None = None,
+    retry: RetryPolicy | None = None,
 ) -> AsyncGenerator[Tile, None]:
-    for info in iter_tile_info(pano_id, zoom):
-        image = await fetch_panorama_tile_async(info, max_retries)
-        yield Tile(x=info.x, y=info.y, image=image)
-    return
+    """
+    Asynchronously downloads a panorama's tiles, keeping up to `concurrency`
+    requests in flight. Tiles are yielded in the order they complete.
+    """
+    tiles = iter_raw_tiles_async(
+        pano_id=pano_id,
+        zoom=zoom,
+        max_retries=max_retries,
+        concurrency=concurrency,
+        client=client,
+        cache=cache,
+        checkpoint=checkpoint,
+        size=size,
+        retry=retry,
+    )
+    try:
+        async for raw in tiles:
+            yield Tile(x=raw.x, y=raw.y, image=Image.open(BytesIO(raw.data)))
+    finally:
+        await tiles.aclose()
 
 
 def get_panorama(
@@ -139,46 +667,639 @@ def get_panorama(
     zoom: int = 5,
     multi_threaded: bool = False,
     max_retries: int = DEFAULT_MAX_RETRIES,
+    session: requests.Session | None = None,
+    cache: TileCache | None = None,
+    checkpoint: str | os.PathLike | None = None,
+    size: tuple[int, int] | None = None,
+    detect_size: bool = False,
+    retry: RetryPolicy | None = None,
+    controller: AdaptiveConcurrency | None = None,
+    target_width: int | None = None,
+    store: PanoramaStore | None = None,
 ) -> Image.Image:
     """
     Downloads a streetview panorama.
     Multi-threaded is a lot faster, but it's also a lot more likely to get you banned.
+    `streetview.ratelimit.set_rate_limiter` caps the request rate of every thread.
+    The threads back off when the server struggles, pass an `AdaptiveConcurrency`
+    as `controller` to tune them or to see how many requests are in flight.
+    Pass a `TileCache` as `cache` to reuse tiles downloaded by earlier runs.
+
+    With `detect_size=True`, or a known `size` in pixels, only the tiles with
+    the picture in them are downloaded and the panorama comes back without
+    the black border that user-contributed panoramas often have.
+
+    With a `checkpoint` directory, tiles are saved as they arrive so a failed
+    download can pick up where it stopped. They are deleted once the
+    panorama is complete.
+
+    Pass a `RetryPolicy` as `retry` to tune how throttled or failed tile
+    requests are retried.
+
+    For a thumbnail or preview, pass the `target_width` in pixels. The lowest
+    zoom level up to `zoom` that is wide enough is downloaded, and its tiles
+    are decoded at a half, a quarter or an eighth of their size when that's
+    still enough, which saves both decoding time and memory. The panorama is
+    then resized to exactly `target_width`. A `size` is in pixels at `zoom`,
+    it's scaled to the zoom level that is downloaded.
+
+    With a `PanoramaStore` as `store`, a panorama already in it is returned
+    without any requests, and a downloaded one is added to it. Concurrent
+    calls for the same panorama download it only once. The store is keyed by
+    `pano_id` and `zoom` only, so it can't be combined with `target_width`,
+    `size` or `detect_size`.
     """
-    tile_width = 512
-    tile_height = 512
+    if store is not None:
+        if target_width is not None or size is not None or detect_size:
+            raise ValueError(
+                "a store keeps whole panoramas, it can't take target_width, "
+                "size or detect_size"
+            )
+        return store.get_or_put(
+            pano_id,
+            zoom,
+            lambda: get_panorama(
+                pano_id=pano_id,
+                zoom=zoom,
+                multi_threaded=multi_threaded,
+                max_retries=max_retries,
+                session=session,
+                cache=cache,
+                checkpoint=checkpoint,
+                retry=retry,
+                controller=controller,
+            ),
+        )
 
-    total_width, total_height = get_width_and_height_from_zoom(zoom)
-    panorama = Image.new("RGB", (total_width * tile_width, total_height * tile_height))
+    scale = 1
+    if target_width is not None:
+        picked, scale = pick_zoom_and_scale(target_width, zoom)
+        if size is not None:
+            size = scale_size(size, zoom, picked)
+        zoom = picked
+    if detect_size and size is None:
+        size = get_panorama_size(pano_id, zoom, max_retries, session, cache, retry)
+    panorama = new_panorama_image(zoom, size, scale)
 
     for tile in iter_tiles(
         pano_id=pano_id,
         zoom=zoom,
         multi_threaded=multi_threaded,
         max_retries=max_retries,
+        session=session,
+        cache=cache,
+        checkpoint=checkpoint,
+        size=size,
+        retry=retry,
+        controller=controller,
     ):
-        panorama.paste(im=tile.image, box=(tile.x * tile_width, tile.y * tile_height))
+        panorama.paste(
+            im=draft_tile(tile, scale),
+            box=(tile.x * TILE_SIZE // scale, tile.y * TILE_SIZE // scale),
+        )
         del tile
 
+    remove_checkpoint(checkpoint, pano_id, zoom)
+    if target_width is not None:
+        return resize_to_width(panorama, target_width)
     return panorama
 
 
 async def get_panorama_async(
-    pano_id: str, zoom: int, max_retries: int = DEFAULT_MAX_RETRIES
+    pano_id: str,
+    zoom: int = 5,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    client: httpx.AsyncClient | None = None,
+    cache: TileCache | None = None,
+    checkpoint: str | os.PathLike | None = None,
+    size: tuple[int, int] | None = None,
+    retry: RetryPolicy | None = None,
+    target_width: int | None = None,
+    store: PanoramaStore | None = None,
 ) -> Image.Image:
     """
-    Downloads a streetview panorama by iterating through the tiles asynchronously.
-    This runs in about the same speed as `get_panorama` with `multi_threaded=True`.
+    Downloads a streetview panorama by fetching the tiles asynchronously.
+    Up to `concurrency` tile requests are kept in flight at once, so this runs
+    in about the same speed as `get_panorama` with `multi_threaded=True`.
+
+    Pass a `StreetViewClient` as `client` to control its connection pool,
+    otherwise a default client for the running event loop is reused.
+    If the panorama's `size` in pixels is known, e.g. from
+    `get_panorama_size`, only the tiles inside it are downloaded.
+    A `checkpoint` directory works like it does for `get_panorama`, and so
+    does `target_width`. So does `store`, coalescing concurrent tasks.
+    """
+    if store is not None:
+        if target_width is not None or size is not None:
+            raise ValueError(
+                "a store keeps whole panoramas, it can't take target_width or size"
+            )
+        return await store.get_or_put_async(
+            pano_id,
+            zoom,
+            lambda: get_panorama_async(
+                pano_id=pano_id,
+                zoom=zoom,
+                max_retries=max_retries,
+                concurrency=concurrency,
+                client=client,
+                cache=cache,
+                checkpoint=checkpoint,
+                retry=retry,
+            ),
+        )
+
+    scale = 1
+    if target_width is not None:
+        picked, scale = pick_zoom_and_scale(target_width, zoom)
+        if size is not None:
+            size = scale_size(size, zoom, picked)
+        zoom = picked
+    panorama = new_panorama_image(zoom, size, scale)
+
+    async for tile in iter_tiles_async(
+        pano_id=pano_id,
+        zoom=zoom,
+        max_retries=max_retries,
+        concurrency=concurrency,
+        client=client,
+        cache=cache,
+        checkpoint=checkpoint,
+        size=size,
+        retry=retry,
+    ):
+        panorama.paste(
+            im=draft_tile(tile, scale),
+            box=(tile.x * TILE_SIZE // scale, tile.y * TILE_SIZE // scale),
+        )
+        del tile
+
+    await asyncio.to_thread(remove_checkpoint, checkpoint, pano_id, zoom)
+    if target_width is not None:
+        return resize_to_width(panorama, target_width)
+    return panorama
+
+
+def new_panorama_array(
+    zoom: int, size: tuple[int, int] | None = None, out: "np.ndarray | None" = None
+) -> "np.ndarray":
+    """
+    Returns a `(height, width, 3)` uint8 array to hold a panorama, the same
+    size as `new_panorama_image`. If `out` is given it's checked and used
+    instead, so it can be any buffer of the right shape, e.g. an `np.memmap`.
+    """
+    import numpy as np  # pyright: ignore[reportMissingImports]
+
+    if size is None:
+        width, height = get_width_and_height_from_zoom(zoom)
+        size = (width * TILE_SIZE, height * TILE_SIZE)
+    shape = (size[1], size[0], 3)
+    if out is None:
+        return np.zeros(shape, dtype=np.uint8)
+    if out.shape != shape or out.dtype != np.uint8:
+        raise ValueError(f"out must be a uint8 array of shape {shape}")
+    return out
+
+
+def write_tile_to_array(array: "np.ndarray", tile: Tile) -> None:
+    """
+    Copies a decoded tile straight into its slice of a panorama array,
+    clipped to the array's edges.
+    """
+    import numpy as np  # pyright: ignore[reportMissingImports]
+
+    image = tile.image if tile.image.mode == "RGB" else tile.image.convert("RGB")
+    top, left = tile.y * TILE_SIZE, tile.x * TILE_SIZE
+    height = min(image.height, array.shape[0] - top)
+    width = min(image.width, array.shape[1] - left)
+    array[top : top + height, left : left + width] = np.asarray(image)[:height, :width]
+
+
+def get_panorama_array(
+    pano_id: str,
+    zoom: int = 5,
+    multi_threaded: bool = False,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    session: requests.Session | None = None,
+    cache: TileCache | None = None,
+    checkpoint: str | os.PathLike | None = None,
+    size: tuple[int, int] | None = None,
+    detect_size: bool = False,
+    retry: RetryPolicy | None = None,
+    controller: AdaptiveConcurrency | None = None,
+    out: "np.ndarray | None" = None,
+) -> "np.ndarray":
+    """
+    Downloads a streetview panorama like `get_panorama`, but as a
+    `(height, width, 3)` uint8 NumPy array. Each tile is written straight into
+    its slice of the array, without the PIL canvas and the copy that
+    `np.asarray(get_panorama(...))` makes of it.
+
+    Pass a preallocated array, or an `np.memmap` for panoramas too big for
+    memory, as `out` to fill it in place. Every pixel of it is overwritten.
+    Needs NumPy.
     """
-    tile_width = 512
-    tile_height = 512
+    if detect_size and size is None:
+        size = get_panorama_size(pano_id, zoom, max_retries, session, cache, retry)
+    panorama = new_panorama_array(zoom, size, out)
 
-    total_width, total_height = get_width_and_height_from_zoom(zoom)
-    panorama = Image.new("RGB", (total_width * tile_width, total_height * tile_height))
+    for tile in iter_tiles(
+        pano_id=pano_id,
+        zoom=zoom,
+        multi_threaded=multi_threaded,
+        max_retries=max_retries,
+        session=session,
+        cache=cache,
+        checkpoint=checkpoint,
+        size=size,
+        retry=retry,
+        controller=controller,
+    ):
+        write_tile_to_array(panorama, tile)
+        del tile
+
+    remove_checkpoint(checkpoint, pano_id, zoom)
+    return panorama
+
+
+async def get_panorama_array_async(
+    pano_id: str,
+    zoom: int = 5,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    client: httpx.AsyncClient | None = None,
+    cache: TileCache | None = None,
+    checkpoint: str | os.PathLike | None = None,
+    size: tuple[int, int] | None = None,
+    retry: RetryPolicy | None = None,
+    out: "np.ndarray | None" = None,
+) -> "np.ndarray":
+    """
+    Asynchronously downloads a streetview panorama into a NumPy array, like
+    `get_panorama_array`.
+    """
+    panorama = new_panorama_array(zoom, size, out)
 
     async for tile in iter_tiles_async(
-        pano_id=pano_id, zoom=zoom, max_retries=max_retries
+        pano_id=pano_id,
+        zoom=zoom,
+        max_retries=max_retries,
+        concurrency=concurrency,
+        client=client,
+        cache=cache,
+        checkpoint=checkpoint,
+        size=size,
+        retry=retry,
     ):
-        panorama.paste(im=tile.image, box=(tile.x * tile_width, tile.y * tile_height))
+        write_tile_to_array(panorama, tile)
         del tile
 
+    await asyncio.to_thread(remove_checkpoint, checkpoint, pano_id, zoom)
     return panorama
+
+
+class PanoramaFile:
+    """
+    A panorama being written straight to disk as a binary PPM image.
+
+    The file is memory mapped and each tile is copied into place as it
+    arrives, so only one tile at a time is held in memory however big the
+    panorama is. PPM is uncompressed RGB after a short header, so the file
+    can be opened by PIL or mapped into memory again later.
+    """
+
+    def __init__(self, path: str | os.PathLike, zoom: int):
+        width, height = get_width_and_height_from_zoom(zoom)
+        self.path = Path(path)
+        self.width = width * TILE_SIZE
+        self.height = height * TILE_SIZE
+        header = f"P6\n{self.width} {self.height}\n255\n".encode()
+        self.offset = len(header)
+
+        with open(self.path, "wb") as f:
+            f.write(header)
+            # Unwritten tiles stay black, like the canvas of get_panorama.
+            f.truncate(self.offset + self.width * self.height * 3)
+        self._file = open(self.path, "r+b")  # noqa: SIM115
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+
+    def write(self, tile: Tile) -> None:
+        """
+        Copies a tile into its place in the panorama.
+        """
+        image = tile.image if tile.image.mode == "RGB" else tile.image.convert("RGB")
+        width = min(image.width, self.width - tile.x * TILE_SIZE)
+        height = min(image.height, self.height - tile.y * TILE_SIZE)
+        data = memoryview(image.tobytes())
+        stride = image.width * 3
+        row_size = width * 3
+        for row in range(height):
+            pixel = (tile.y * TILE_SIZE + row) * self.width + tile.x * TILE_SIZE
+            start = self.offset + pixel * 3
+            self._mmap[start : start + row_size] = data[
+                row * stride : row * stride + row_size
+            ]
+
+    def close(self) -> None:
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> "PanoramaFile":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def save_panorama(
+    pano_id: str,
+    path: str | os.PathLike,
+    zoom: int = 5,
+    multi_threaded: bool = False,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    session: requests.Session | None = None,
+    cache: TileCache | None = None,
+    checkpoint: str | os.PathLike | None = None,
+    retry: RetryPolicy | None = None,
+    controller: AdaptiveConcurrency | None = None,
+) -> Path:
+    """
+    Downloads a streetview panorama straight into a PPM file at `path`,
+    without ever holding the whole panorama in memory. Use this instead of
+    `get_panorama` for high zoom levels, where a panorama takes hundreds of
+    megabytes. A `checkpoint` directory works like it does for
+    `get_panorama`, so big downloads can be resumed.
+    """
+    with PanoramaFile(path, zoom) as panorama:
+        for tile in iter_tiles(
+            pano_id=pano_id,
+            zoom=zoom,
+            multi_threaded=multi_threaded,
+            max_retries=max_retries,
+            session=session,
+            cache=cache,
+            checkpoint=checkpoint,
+            retry=retry,
+            controller=controller,
+        ):
+            panorama.write(tile)
+            del tile
+    remove_checkpoint(checkpoint, pano_id, zoom)
+    return panorama.path
+
+
+async def save_panorama_async(
+    pano_id: str,
+    path: str | os.PathLike,
+    zoom: int = 5,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    client: httpx.AsyncClient | None = None,
+    cache: TileCache | None = None,
+    checkpoint: str | os.PathLike | None = None,
+    retry: RetryPolicy | None = None,
+) -> Path:
+    """
+    Asynchronously downloads a streetview panorama straight into a PPM file
+    at `path`, like `save_panorama`.
+    """
+    with PanoramaFile(path, zoom) as panorama:
+        async for tile in iter_tiles_async(
+            pano_id=pano_id,
+            zoom=zoom,
+            max_retries=max_retries,
+            concurrency=concurrency,
+            client=client,
+            cache=cache,
+            checkpoint=checkpoint,
+            retry=retry,
+        ):
+            panorama.write(tile)
+            del tile
+    await asyncio.to_thread(remove_checkpoint, checkpoint, pano_id, zoom)
+    return panorama.path
+
+
+def export_tiles(
+    pano_id: str,
+    path: str | os.PathLike,
+    zoom: int = 5,
+    multi_threaded: bool = False,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    session: requests.Session | None = None,
+    cache: TileCache | None = None,
+    retry: RetryPolicy | None = None,
+    controller: AdaptiveConcurrency | None = None,
+) -> Path:
+    """
+    Downloads a panorama's tiles and writes the original JPEGs, untouched, as
+    `{zoom}/{x}_{y}.jpg`. If `path` ends in `.zip` the tiles are written into
+    a zip file, otherwise into a directory.
+    """
+    path = Path(path)
+    tiles = iter_raw_tiles(
+        pano_id=pano_id,
+        zoom=zoom,
+        max_retries=max_retries,
+        multi_threaded=multi_threaded,
+        session=session,
+        cache=cache,
+        retry=retry,
+        controller=controller,
+    )
+    with open_tile_writer(path) as write:
+        for tile in tiles:
+            write(f"{zoom}/{tile.x}_{tile.y}.jpg", tile.data)
+    return path
+
+
+@contextlib.contextmanager
+def open_tile_writer(path: Path) -> Generator[Callable[[str, bytes], None], None, None]:
+    """
+    Yields a function that writes a file, given its name relative to `path`,
+    into a zip file if `path` ends in `.zip` or into a directory otherwise.
+    """
+    if path.suffix == ".zip":
+        # JPEGs are already compressed, so they are stored as they are.
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as archive:
+            yield archive.writestr
+        return
+
+    def write(name: str, data: bytes) -> None:
+        (path / name).parent.mkdir(parents=True, exist_ok=True)
+        (path / name).write_bytes(data)
+
+    yield write
+
+
+def downsample_tiles(
+    children: dict[tuple[int, int], Image.Image], quality: int = DEFAULT_QUALITY
+) -> tuple[Image.Image, bytes]:
+    """
+    Makes a tile of the next zoom level down from the up to four tiles it
+    covers, keyed by their `(x, y)` offset of 0 or 1. Returns the tile and
+    its JPEG bytes.
+    """
+    canvas = Image.new("RGB", (2 * TILE_SIZE, 2 * TILE_SIZE))
+    right = bottom = 0
+    for (dx, dy), child in children.items():
+        canvas.paste(child, (dx * TILE_SIZE, dy * TILE_SIZE))
+        right = max(right, dx * TILE_SIZE + child.width)
+        bottom = max(bottom, dy * TILE_SIZE + child.height)
+    # The edge of the grid, e.g. zoom 0 which is only half a tile high.
+    if (right, bottom) != canvas.size:
+        canvas = canvas.crop((0, 0, right, bottom))
+    # Averages each 2x2 block of pixels, a box filter.
+    tile = canvas.reduce(2)
+    buffer = BytesIO()
+    tile.save(buffer, "jpeg", quality=quality)
+    return tile, buffer.getvalue()
+
+
+def export_pyramid(
+    pano_id: str,
+    path: str | os.PathLike,
+    zoom: int = 5,
+    min_zoom: int = 0,
+    quality: int = DEFAULT_QUALITY,
+    workers: int | None = None,
+    multi_threaded: bool = False,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    session: requests.Session | None = None,
+    cache: TileCache | None = None,
+    retry: RetryPolicy | None = None,
+    controller: AdaptiveConcurrency | None = None,
+) -> Path:
+    """
+    Writes a panorama's tiles at every zoom level from `zoom` down to
+    `min_zoom` as `{zoom}/{x}_{y}.jpg`, the layout web panorama viewers load.
+    If `path` ends in `.zip` they are written into a zip file, otherwise into
+    a directory.
+
+    Only `zoom` is downloaded, its tiles are written untouched. Each lower
+    level is made by halving the one above it, each of its tiles from the
+    four it covers, with the tiles decoded, downsampled and encoded in
+    parallel on `workers` threads.
+    """
+    path = Path(path)
+    tiles = iter_raw_tiles(
+        pano_id=pano_id,
+        zoom=zoom,
+        max_retries=max_retries,
+        multi_threaded=multi_threaded,
+        session=session,
+        cache=cache,
+        retry=retry,
+        controller=controller,
+    )
+    with (
+        open_tile_writer(path) as write,
+        concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor,
+    ):
+        level: dict[tuple[int, int], Image.Image] = {}
+        for tile in tiles:
+            write(f"{zoom}/{tile.x}_{tile.y}.jpg", tile.data)
+            # Decoded by a worker thread when it's downsampled.
+            level[tile.x, tile.y] = Image.open(BytesIO(tile.data))
+
+        for level_zoom in range(zoom - 1, min_zoom - 1, -1):
+            parents: dict[tuple[int, int], dict[tuple[int, int], Image.Image]] = {}
+            for (x, y), image in level.items():
+                parents.setdefault((x // 2, y // 2), {})[x % 2, y % 2] = image
+            level = {}
+            # Only the executor holds on to each group of children, so they
+            # are freed as soon as their parent is made. Otherwise the whole
+            # decoded level above would stay in memory.
+            futures = {
+                executor.submit(downsample_tiles, parents.pop(xy), quality): xy
+                for xy in list(parents)
+            }
+            # Written in the order they were submitted so the layout of a zip
+            # file doesn't depend on thread timing.
+            for future, (x, y) in futures.items():
+                level[x, y], data = future.result()
+                write(f"{level_zoom}/{x}_{y}.jpg", data)
+    return path
+
+
+def download_panoramas(
+    pano_ids: Iterable[str],
+    zoom: int = 5,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    session: requests.Session | None = None,
+    cache: TileCache | None = None,
+    retry: RetryPolicy | None = None,
+) -> Generator[tuple[str, Image.Image], None, None]:
+    """
+    Downloads many panoramas through one shared pool of `concurrency` threads.
+
+    Tiles of the next panoramas are queued while earlier panoramas are still
+    downloading, so the threads never wait at a panorama boundary. Panoramas
+    are yielded as `(pano_id, image)` as soon as all of their tiles arrive,
+    which isn't necessarily the order of `pano_ids`.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    session = session or get_session()
+    width, height = get_width_and_height_from_zoom(zoom)
+
+    # Panoramas are keyed by their position in `pano_ids` so repeated ids
+    # don't share a canvas.
+    jobs = (
+        (index, pano_id, info)
+        for index, pano_id in enumerate(pano_ids)
+        for info in iter_tile_info(pano_id, zoom)
+    )
+    panoramas: dict[int, Image.Image] = {}
+    remaining: dict[int, int] = {}
+    pending: dict[concurrent.futures.Future[Image.Image], tuple[int, str, TileInfo]]
+    pending = {}
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+
+    def submit_next() -> None:
+        job = next(jobs, None)
+        if job is None:
+            return
+        index, _, info = job
+        if index not in panoramas:
+            panoramas[index] = new_panorama_image(zoom)
+            remaining[index] = width * height
+        future = executor.submit(
+            fetch_panorama_tile, info, max_retries, session, cache, retry
+        )
+        pending[future] = job
+
+    try:
+        # Keep a couple of tiles queued per thread so none of them go idle.
+        for _ in range(2 * concurrency):
+            submit_next()
+
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                index, pano_id, info = pending.pop(future)
+                try:
+                    image = future.result()
+                except Exception as exc:
+                    msg = (
+                        f"Failed to download tile {info.fileurl} "
+                        f"due to Exception: {exc}"
+                    )
+                    raise Exception(msg) from exc
+
+                submit_next()
+                panoramas[index].paste(
+                    im=image, box=(info.x * TILE_SIZE, info.y * TILE_SIZE)
+                )
+                remaining[index] -= 1
+                if remaining[index] == 0:
+                    del remaining[index]
+                    yield pano_id, panoramas.pop(index)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
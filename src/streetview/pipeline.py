@@ -0,0 +1,150 @@
+import asyncio
+import concurrent.futures
+import os
+from collections.abc import AsyncGenerator, Iterable
+from io import BytesIO
+from pathlib import Path
+
+import httpx
+from PIL import Image
+
+from .cache import TileCache, write_atomically
+from .client import get_async_client
+from .download import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_QUALITY,
+    TILE_SIZE,
+    RawTile,
+    iter_raw_tiles_async,
+    new_panorama_image,
+)
+from .tools import crop_bottom_and_right_black_border
+
+
+def stitch_panorama(
+    tiles: list[RawTile],
+    zoom: int,
+    path: str | os.PathLike,
+    crop: bool = False,
+    quality: int = DEFAULT_QUALITY,
+) -> Path:
+    """
+    Decodes a panorama's tiles, pastes them together, optionally crops the
+    black border and saves the result to `path` in the format its suffix
+    names. `quality` only matters for JPEG.
+
+    This is the CPU heavy part of a download, `save_panoramas_async` runs it
+    in worker processes.
+    """
+    path = Path(path)
+    image_format = Image.registered_extensions().get(path.suffix.lower())
+    if image_format is None:
+        raise ValueError(f"unsupported image suffix: {path.suffix!r}")
+
+    panorama = new_panorama_image(zoom)
+    for tile in tiles:
+        with Image.open(BytesIO(tile.data)) as image:
+            panorama.paste(im=image, box=(tile.x * TILE_SIZE, tile.y * TILE_SIZE))
+    if crop:
+        panorama = crop_bottom_and_right_black_border(panorama)
+
+    buffer = BytesIO()
+    panorama.save(buffer, format=image_format, quality=quality)
+    # Readers never see a half written panorama.
+    write_atomically(path, buffer.getvalue())
+    return path
+
+
+async def save_panoramas_async(
+    pano_ids: Iterable[str],
+    directory: str | os.PathLike,
+    zoom: int = 5,
+    suffix: str = ".jpg",
+    crop: bool = False,
+    quality: int = DEFAULT_QUALITY,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    processes: int | None = None,
+    downloads: int | None = None,
+    executor: concurrent.futures.ProcessPoolExecutor | None = None,
+    client: httpx.AsyncClient | None = None,
+    cache: TileCache | None = None,
+) -> AsyncGenerator[tuple[str, Path], None]:
+    """
+    Downloads many panoramas and saves each one to `directory` as
+    `{pano_id}{suffix}`, yielding `(pano_id, path)` as each file is written.
+
+    The tiles are fetched on the event loop, `concurrency` at a time per
+    panorama, while decoding, stitching, cropping and encoding run in a pool
+    of processes, so throughput scales with the number of cores instead of
+    stopping at the one that holds the GIL. The pool has `processes`
+    processes, one per core by default, or pass your own `executor`.
+    `downloads` panoramas, by default twice the number of processes, are
+    downloaded at once so the pool never waits for the network.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+    if downloads is None:
+        downloads = 2 * (processes or os.cpu_count() or 1)
+    if downloads < 1:
+        raise ValueError("downloads must be at least 1")
+    if suffix.lower() not in Image.registered_extensions():
+        raise ValueError(f"unsupported image suffix: {suffix!r}")
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    client = client or get_async_client()
+    own_executor = executor is None
+    if executor is None:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes)
+
+    loop = asyncio.get_running_loop()
+    jobs = iter(pano_ids)
+    results: asyncio.Queue[tuple[str, Path] | Exception | None] = asyncio.Queue()
+
+    async def worker() -> None:
+        try:
+            # Workers share `jobs`, each panorama is downloaded once.
+            for pano_id in jobs:
+                try:
+                    tiles = [
+                        tile
+                        async for tile in iter_raw_tiles_async(
+                            pano_id,
+                            zoom,
+                            concurrency=concurrency,
+                            client=client,
+                            cache=cache,
+                        )
+                    ]
+                    path = await loop.run_in_executor(
+                        executor,
+                        stitch_panorama,
+                        tiles,
+                        zoom,
+                        directory / f"{pano_id}{suffix}",
+                        crop,
+                        quality,
+                    )
+                except Exception as exc:
+                    results.put_nowait(exc)
+                    return
+                results.put_nowait((pano_id, path))
+        finally:
+            results.put_nowait(None)
+
+    workers = [asyncio.create_task(worker()) for _ in range(downloads)]
+    running = len(workers)
+    try:
+        while running:
+            item = await results.get()
+            if item is None:
+                running -= 1
+                continue
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        for task in workers:
+            task.cancel()
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,154 @@
+import asyncio
+import importlib.util
+import os
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+_rate_limiter: "RateLimiter | None" = None
+_rate_limiter_lock = threading.Lock()
+
+
+def take_token(
+    tokens: float, elapsed: float, rate: float, burst: float
+) -> tuple[float, float]:
+    """
+    Refills a token bucket for `elapsed` seconds and takes a token out of it.
+    Returns the tokens left and how many seconds to wait for the one taken.
+
+    The bucket can go negative: a request that has to wait reserves its token
+    straight away, so concurrent callers queue up behind each other instead
+    of all waking up at the same time.
+    """
+    tokens = min(burst, tokens + elapsed * rate) - 1
+    return tokens, max(0.0, -tokens / rate)
+
+
+class RateLimiter:
+    """
+    A token bucket per host: on average `rate` requests a second, with bursts
+    of up to `burst` requests after a quiet spell.
+
+    It is shared by all the threads and event loops of a process. Use
+    `FileRateLimiter` to share a budget between processes.
+    """
+
+    def __init__(self, rate: float, burst: float | None = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = max(1.0, rate) if burst is None else burst
+        self._lock = threading.Lock()
+        self._buckets: dict[str, tuple[float, float]] = {}
+
+    def reserve(self, host: str) -> float:
+        """
+        Takes a token for a request to `host` and returns how many seconds to
+        wait before sending it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(host, (self.burst, now))
+            tokens, wait = take_token(tokens, now - updated, self.rate, self.burst)
+            self._buckets[host] = (tokens, now)
+        return wait
+
+    def acquire(self, url: str) -> None:
+        """
+        Blocks until a request to `url` is allowed.
+        """
+        wait = self.reserve(urlsplit(url).netloc)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, url: str) -> None:
+        """
+        Waits, without blocking the event loop, until a request to `url` is
+        allowed.
+        """
+        wait = self.reserve(urlsplit(url).netloc)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class FileRateLimiter(RateLimiter):
+    """
+    A `RateLimiter` whose buckets live in files in `directory`, so that every
+    process on the machine using the same directory shares one budget.
+
+    Each bucket is read and updated under an exclusive `flock`, which is only
+    held for the few microseconds that takes. Unix only.
+    """
+
+    def __init__(
+        self, directory: str | os.PathLike, rate: float, burst: float | None = None
+    ):
+        # fcntl is only there on Unix.
+        if importlib.util.find_spec("fcntl") is None:
+            raise RuntimeError("FileRateLimiter needs fcntl, which this OS lacks")
+        super().__init__(rate, burst)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def reserve(self, host: str) -> float:
+        import fcntl
+
+        path = self.directory / f"{host.replace(':', '_')}.bucket"
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # The wall clock, unlike the monotonic one, is the same in every
+            # process.
+            now = time.time()
+            try:
+                tokens_text, updated_text = os.read(fd, 64).split()
+                tokens, updated = float(tokens_text), float(updated_text)
+            except ValueError:
+                # A new or garbled bucket starts full.
+                tokens, updated = self.burst, now
+            tokens, wait = take_token(
+                tokens, max(0.0, now - updated), self.rate, self.burst
+            )
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, f"{tokens!r} {now!r}".encode())
+        finally:
+            os.close(fd)
+        return wait
+
+
+def get_rate_limiter() -> RateLimiter | None:
+    """
+    Returns the rate limiter every request waits for, or `None` if requests
+    aren't limited, which is the default.
+    """
+    return _rate_limiter
+
+
+def set_rate_limiter(rate_limiter: RateLimiter | None) -> None:
+    """
+    Sets the rate limiter every request to Google waits for, in search,
+    metadata and tile downloads alike. Pass `None` to stop limiting.
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        _rate_limiter = rate_limiter
+
+
+def throttle(url: str) -> None:
+    """
+    Blocks until the rate limiter, if there is one, allows a request to `url`.
+    """
+    rate_limiter = _rate_limiter
+    if rate_limiter is not None:
+        rate_limiter.acquire(url)
+
+
+async def throttle_async(url: str) -> None:
+    """
+    Waits until the rate limiter, if there is one, allows a request to `url`.
+    """
+    rate_limiter = _rate_limiter
+    if rate_limiter is not None:
+        await rate_limiter.acquire_async(url)
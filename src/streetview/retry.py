@@ -0,0 +1,66 @@
+import email.utils
+import random
+import time
+from dataclasses import dataclass
+
+from .client import DEFAULT_TIMEOUT
+
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 30.0
+# Rate limited, or a server or gateway that's having a bad moment.
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Returns how many seconds a `Retry-After` header asks to wait. It's either
+    a number of seconds or an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    How requests are retried after a connection error, a timeout or a
+    response with one of `statuses`.
+
+    The n-th retry waits a random time up to `backoff * 2**n` seconds, capped
+    at `max_backoff`. Randomising the whole wait ("full jitter") spreads out
+    the retries of many concurrent requests that failed together. A
+    `Retry-After` header from the server takes precedence, still capped at
+    `max_backoff`. `timeout` is passed to every request, `None` waits forever.
+    """
+
+    max_retries: int = DEFAULT_MAX_RETRIES
+    backoff: float = DEFAULT_BACKOFF
+    max_backoff: float = DEFAULT_MAX_BACKOFF
+    jitter: bool = True
+    timeout: float | None = DEFAULT_TIMEOUT
+    statuses: frozenset[int] = RETRY_STATUSES
+
+    def should_retry(self, status_code: int) -> bool:
+        return status_code in self.statuses
+
+    def delay(self, attempt: int, retry_after: str | None = None) -> float:
+        """
+        Returns how many seconds to wait before retrying after the `attempt`-th
+        try, counting from 0.
+        """
+        wait = parse_retry_after(retry_after)
+        if wait is None:
+            wait = min(self.max_backoff, self.backoff * 2**attempt)
+            if self.jitter:
+                wait = random.uniform(0, wait)
+        return min(wait, self.max_backoff)
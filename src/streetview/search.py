@@ -1,10 +1,42 @@
+import asyncio
 import json
+import os
 import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import AsyncGenerator, Iterable
+from typing import NamedTuple, overload
 
+import httpx
 import requests
 from pydantic import BaseModel
 from requests.models import Response
 
+from .client import get_async_client, get_session
+from .ratelimit import throttle, throttle_async
+from .singleflight import coalesce, coalesce_async
+
+# orjson is optional, it decodes search responses a few times faster.
+try:
+    import orjson  # pyright: ignore[reportMissingImports]
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+
+class PanoramaTuple(NamedTuple):
+    pano_id: str
+    lat: float
+    lon: float
+    heading: float
+    pitch: float | None
+    roll: float | None
+    date: str | None
+    elevation: float | None
+
 
 class Panorama(BaseModel):
     pano_id: str
@@ -17,41 +49,196 @@ class Panorama(BaseModel):
     elevation: float | None
 
 
-def make_search_url(lat: float, lon: float) -> str:
+DEFAULT_SEARCH_RADIUS = 50
+DEFAULT_SEARCH_CONCURRENCY = 16
+
+# About 11 m of latitude, well inside the 50 m search radius.
+DEFAULT_CELL_SIZE = 1e-4
+DEFAULT_SEARCH_TTL = 7 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 10_000
+
+
+class SearchCache:
+    """
+    Caches search results by location.
+
+    Coordinates are snapped to a grid of `cell_size` degrees, so searches a
+    few metres apart share one result. Results expire after `ttl` seconds
+    (`None` keeps them forever) as new panoramas get published. Up to
+    `max_entries` results are kept in memory, least recently used first out.
+
+    Give a `path` to also keep results in a SQLite database, which survives
+    restarts and can be shared between processes.
+    """
+
+    def __init__(
+        self,
+        cell_size: float = DEFAULT_CELL_SIZE,
+        ttl: float | None = DEFAULT_SEARCH_TTL,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        path: str | os.PathLike | None = None,
+    ):
+        self.cell_size = cell_size
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[int, int], tuple[float, list[Panorama]]]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            with self._db:
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS searches ("
+                    "cell_size REAL, lat INTEGER, lon INTEGER, created REAL,"
+                    "panoramas TEXT, PRIMARY KEY (cell_size, lat, lon))"
+                )
+
+    def key(self, lat: float, lon: float) -> tuple[int, int]:
+        """
+        Returns the grid cell a coordinate falls in.
+        """
+        return round(lat / self.cell_size), round(lon / self.cell_size)
+
+    def _is_fresh(self, created: float) -> bool:
+        return self.ttl is None or time.time() - created < self.ttl
+
+    def get(self, lat: float, lon: float) -> list[Panorama] | None:
+        """
+        Returns the cached panoramas near a coordinate, or `None` if there
+        aren't any.
+        """
+        key = self.key(lat, lon)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                # Cells of another size are other places.
+                row = self._db.execute(
+                    "SELECT created, panoramas FROM searches "
+                    "WHERE cell_size=? AND lat=? AND lon=?",
+                    (self.cell_size, *key),
+                ).fetchone()
+                if row is not None:
+                    created, blob = row
+                    panos = [Panorama(**pano) for pano in json.loads(blob)]
+                    entry = (created, panos)
+                    self._remember(key, entry)
+
+            if entry is None:
+                return None
+            created, panos = entry
+            if not self._is_fresh(created):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return list(panos)
+
+    def put(self, lat: float, lon: float, panoramas: list[Panorama]) -> None:
+        """
+        Caches the panoramas found near a coordinate.
+        """
+        key = self.key(lat, lon)
+        entry = (time.time(), list(panoramas))
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                blob = json.dumps([pano.model_dump() for pano in panoramas])
+                with self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?, ?)",
+                        (self.cell_size, *key, entry[0], blob),
+                    )
+
+    def close(self) -> None:
+        """
+        Closes the SQLite database, if there is one.
+        """
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _remember(
+        self, key: tuple[int, int], entry: tuple[float, list[Panorama]]
+    ) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+def make_search_url(
+    lat: float, lon: float, radius: float = DEFAULT_SEARCH_RADIUS
+) -> str:
     """
     Builds the URL of the script on Google's servers that returns the closest
-    panoramas (ids) to a give GPS coordinate.
+    panoramas (ids) to a give GPS coordinate, within `radius` metres.
     """
     url = (
         "https://maps.googleapis.com/maps/api/js/"
         "GeoPhotoService.SingleImageSearch"
-        "?pb=!1m5!1sapiv3!5sUS!11m2!1m1!1b0!2m4!1m2!3d{0:}!4d{1:}!2d50!3m10"
+        "?pb=!1m5!1sapiv3!5sUS!11m2!1m1!1b0!2m4!1m2!3d{0:}!4d{1:}!2d{2:}!3m10"
         "!2m2!1sen!2sGB!9m1!1e2!11m4!1m3!1e2!2b1!3e2!4m10!1e1!1e2!1e3!1e4"
         "!1e8!1e6!5m1!1e2!6m1!1e2"
         "&callback=callbackfunc"
     )
-    return url.format(lat, lon)
+    return url.format(lat, lon, radius)
 
 
-def search_request(lat: float, lon: float) -> Response:
+def search_request(
+    lat: float,
+    lon: float,
+    session: requests.Session | None = None,
+    radius: float = DEFAULT_SEARCH_RADIUS,
+) -> Response:
     """
     Gets the response of the script on Google's servers that returns the
     closest panoramas (ids) to a give GPS coordinate.
     """
-    url = make_search_url(lat, lon)
-    return requests.get(url)
+    url = make_search_url(lat, lon, radius)
+    session = session or get_session()
+    throttle(url)
+    return session.get(url)
 
 
-def extract_panoramas(text: str) -> list[Panorama]:
+async def search_request_async(
+    lat: float,
+    lon: float,
+    client: httpx.AsyncClient | None = None,
+    radius: float = DEFAULT_SEARCH_RADIUS,
+) -> httpx.Response:
     """
-    Given a valid response from the panoids endpoint, return a list of all the
-    panoids.
+    Asynchronously gets the response of the script on Google's servers that
+    returns the closest panoramas (ids) to a give GPS coordinate.
     """
+    url = make_search_url(lat, lon, radius)
+    client = client or get_async_client()
+    await throttle_async(url)
+    return await client.get(url)
+
 
+def decode_search_response(payload: str | bytes) -> list:
+    """
+    Returns the data in a response from the panoids endpoint.
+    """
     # The response is actually javascript code. It's a function with a single
-    # input which is a huge deeply nested array of items.
-    blob = re.findall(r"callbackfunc\( (.*) \)$", text)[0]
-    data = json.loads(blob)
+    # input which is a huge deeply nested array of items. Slice the array out
+    # rather than run a regex over the whole response.
+    if isinstance(payload, str):
+        start = payload.index("callbackfunc( ") + len("callbackfunc( ")
+        end = payload.rindex(" )")
+    else:
+        start = payload.index(b"callbackfunc( ") + len(b"callbackfunc( ")
+        end = payload.rindex(b" )")
+    return json_loads(payload[start:end])
+
+
+def extract_panorama_tuples(payload: str | bytes) -> list[PanoramaTuple]:
+    """
+    Given a valid response from the panoids endpoint, return a list of all the
+    panoids as plain named tuples. This skips pydantic altogether, which is
+    the fastest way to parse lots of responses.
+    """
+    data = decode_search_response(payload)
 
     if data == [[5, "generic", "Search returned no images."]]:
         return []
@@ -71,7 +258,7 @@ def extract_panoramas(text: str) -> list[Panorama]:
     dates = [f"{d[1][0]}-{d[1][1]:02d}" for d in raw_dates]
 
     return [
-        Panorama(
+        PanoramaTuple(
             pano_id=pano[0][1],
             lat=pano[2][0][2],
             lon=pano[2][0][3],
@@ -85,16 +272,153 @@ def extract_panoramas(text: str) -> list[Panorama]:
     ]
 
 
-def search_panoramas(lat: float, lon: float) -> list[Panorama]:
+def extract_panoramas(payload: str | bytes) -> list[Panorama]:
+    """
+    Given a valid response from the panoids endpoint, return a list of all the
+    panoids.
+    """
+    # Pydantic's validation is cheaper than Panorama.model_construct, which
+    # runs in Python, so there's no point skipping it.
+    return [Panorama(**row._asdict()) for row in extract_panorama_tuples(payload)]
+
+
+# Without options, so that `search_panoramas(**coords)` with a dict of floats
+# type checks.
+@overload
+def search_panoramas(lat: float, lon: float) -> list[Panorama]: ...
+
+
+@overload
+def search_panoramas(
+    lat: float,
+    lon: float,
+    *,
+    session: requests.Session | None = None,
+    cache: SearchCache | None = None,
+) -> list[Panorama]: ...
+
+
+def search_panoramas(
+    lat: float,
+    lon: float,
+    *,
+    session: requests.Session | None = None,
+    cache: SearchCache | None = None,
+) -> list[Panorama]:
     """
     Gets the closest panoramas (ids) to the GPS coordinates.
+    With a `cache`, nearby searches that were already made are not repeated.
+    Threads making the same search at the same time share one request.
+    """
+    if cache is not None:
+        pans = cache.get(lat, lon)
+        if pans is not None:
+            return pans
+
+    pans = coalesce(
+        make_search_url(lat, lon),
+        lambda: extract_panoramas(search_request(lat, lon, session).content),
+    )
+
+    if cache is not None:
+        cache.put(lat, lon, pans)
+    return pans
+
+
+async def search_panoramas_async(
+    lat: float,
+    lon: float,
+    *,
+    client: httpx.AsyncClient | None = None,
+    cache: SearchCache | None = None,
+) -> list[Panorama]:
     """
+    Asynchronously gets the closest panoramas (ids) to the GPS coordinates.
+    Tasks making the same search at the same time share one request.
+    """
+    # The cache may have to read its database, keep that off the event loop.
+    if cache is not None:
+        pans = await asyncio.to_thread(cache.get, lat, lon)
+        if pans is not None:
+            return pans
+
+    async def search() -> list[Panorama]:
+        resp = await search_request_async(lat, lon, client)
+        return extract_panoramas(resp.content)
+
+    pans = await coalesce_async(make_search_url(lat, lon), search)
 
-    resp = search_request(lat, lon)
-    pans = extract_panoramas(resp.text)
+    if cache is not None:
+        await asyncio.to_thread(cache.put, lat, lon, pans)
     return pans
 
 
+async def search_panoramas_many(
+    coords: Iterable[tuple[float, float]],
+    concurrency: int = DEFAULT_SEARCH_CONCURRENCY,
+    ordered: bool = True,
+    client: httpx.AsyncClient | None = None,
+    cache: SearchCache | None = None,
+) -> AsyncGenerator[tuple[int, list[Panorama]], None]:
+    """
+    Searches around many `(lat, lon)` coordinates, with up to `concurrency`
+    searches in flight over one client.
+
+    Yields `(index, panoramas)` where `index` is the coordinate's position in
+    `coords`. With `ordered=True` results come out in the order of `coords`,
+    otherwise they come out as soon as each search finishes.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    client = client or get_async_client()
+    jobs = enumerate(coords)
+    results: asyncio.Queue[tuple[int, list[Panorama] | Exception] | None]
+    results = asyncio.Queue()
+
+    async def worker() -> None:
+        try:
+            # Workers share `jobs`, each coordinate is searched once.
+            for index, (lat, lon) in jobs:
+                try:
+                    pans = await search_panoramas_async(
+                        lat, lon, client=client, cache=cache
+                    )
+                except Exception as exc:
+                    results.put_nowait((index, exc))
+                    return
+                results.put_nowait((index, pans))
+        finally:
+            results.put_nowait(None)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    buffered: dict[int, list[Panorama]] = {}
+    next_index = 0
+    running = len(workers)
+    try:
+        while running:
+            item = await results.get()
+            if item is None:
+                running -= 1
+                continue
+
+            index, result = item
+            if isinstance(result, Exception):
+                raise result
+
+            if not ordered:
+                yield index, result
+                continue
+
+            buffered[index] = result
+            while next_index in buffered:
+                yield next_index, buffered.pop(next_index)
+                next_index += 1
+    finally:
+        for task in workers:
+            task.cancel()
+
+
 def parse_url(url: str) -> tuple[str, ...]:
     """
     extracts the lat, lon and pano_id from url
@@ -109,21 +433,60 @@ def parse_url(url: str) -> tuple[str, ...]:
     return ("", "", "")
 
 
-def search_panoramas_url(url: str) -> list[Panorama]:
+def search_panoramas_url(
+    url: str,
+    session: requests.Session | None = None,
+    cache: SearchCache | None = None,
+) -> list[Panorama]:
     """
     Gets the closest panoramas (ids) to the GPS coordinates in the url.
     """
     lat, lon, _ = parse_url(url)
-    return search_panoramas(float(lat), float(lon))
+    return search_panoramas(float(lat), float(lon), session=session, cache=cache)
 
 
-def search_panoramas_url_exact(url: str) -> Panorama | None:
+def search_panoramas_url_exact(
+    url: str,
+    session: requests.Session | None = None,
+    cache: SearchCache | None = None,
+) -> Panorama | None:
     """
     Searches for exact panorama in url
     """
     _, _, id = parse_url(url)
 
-    panos = search_panoramas_url(url)
+    panos = search_panoramas_url(url, session, cache)
+    panos = [pano for pano in panos if pano.pano_id == id]
+
+    return panos[0] if len(panos) > 0 else None
+
+
+async def search_panoramas_url_async(
+    url: str,
+    client: httpx.AsyncClient | None = None,
+    cache: SearchCache | None = None,
+) -> list[Panorama]:
+    """
+    Asynchronously gets the closest panoramas (ids) to the GPS coordinates in
+    the url.
+    """
+    lat, lon, _ = parse_url(url)
+    return await search_panoramas_async(
+        float(lat), float(lon), client=client, cache=cache
+    )
+
+
+async def search_panoramas_url_exact_async(
+    url: str,
+    client: httpx.AsyncClient | None = None,
+    cache: SearchCache | None = None,
+) -> Panorama | None:
+    """
+    Asynchronously searches for exact panorama in url
+    """
+    _, _, id = parse_url(url)
+
+    panos = await search_panoramas_url_async(url, client, cache)
     panos = [pano for pano in panos if pano.pano_id == id]
 
     return panos[0] if len(panos) > 0 else None
@@ -0,0 +1,131 @@
+import asyncio
+import concurrent.futures
+import functools
+import threading
+from collections.abc import Callable, Coroutine, Hashable
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Threads that ask for a key while
+    a call for it is in flight wait for that call and share its result, or
+    its exception, instead of making their own.
+
+    Nothing is kept once the call is done, it only coalesces concurrent
+    calls. Use a cache to reuse results.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, concurrent.futures.Future] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """
+        Returns `fn()`, or the result of the call for `key` already in flight.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if future is None:
+                future = self._calls[key] = concurrent.futures.Future()
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+@dataclass
+class AsyncCall:
+    task: asyncio.Task
+    # How many callers are awaiting the task.
+    waiters: int = 0
+
+
+class AsyncSingleFlight:
+    """
+    `SingleFlight` for coroutines: tasks that ask for a key while a call for
+    it is in flight on the same event loop await that call.
+
+    The call runs in a task of its own, so cancelling one of the callers
+    doesn't cancel it for the others. Once every caller is cancelled the call
+    is cancelled too, so it doesn't keep sending requests nobody waits for.
+    """
+
+    def __init__(self):
+        self._calls: dict[tuple[asyncio.AbstractEventLoop, Hashable], AsyncCall] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Coroutine[Any, Any, T]]) -> T:
+        """
+        Returns `await fn()`, or the result of the call for `key` already in
+        flight.
+        """
+        loop = asyncio.get_running_loop()
+        # Keyed by loop too, as a task can only be awaited on its own loop.
+        call_key = (loop, key)
+        call = self._calls.get(call_key)
+        if call is None:
+            call = self._calls[call_key] = AsyncCall(loop.create_task(fn()))
+            call.task.add_done_callback(functools.partial(self._finish, call_key, call))
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Every caller was cancelled. Later callers start afresh
+                # rather than join a call that is being cancelled.
+                self._forget(call_key, call)
+                call.task.cancel()
+
+    def _finish(
+        self,
+        call_key: tuple[asyncio.AbstractEventLoop, Hashable],
+        call: AsyncCall,
+        task: asyncio.Task,
+    ) -> None:
+        self._forget(call_key, call)
+        # Nobody may be left to see the exception, don't let asyncio log it.
+        if not task.cancelled():
+            task.exception()
+
+    def _forget(
+        self, call_key: tuple[asyncio.AbstractEventLoop, Hashable], call: AsyncCall
+    ) -> None:
+        if self._calls.get(call_key) is call:
+            del self._calls[call_key]
+
+
+_single_flight = SingleFlight()
+_async_single_flight = AsyncSingleFlight()
+
+
+def coalesce(key: Hashable, fn: Callable[[], T]) -> T:
+    """
+    Returns `fn()`, sharing the call with every thread of the process asking
+    for the same `key` at the same time. Searches, metadata and tile requests
+    are coalesced on their URL.
+    """
+    return _single_flight.do(key, fn)
+
+
+async def coalesce_async(key: Hashable, fn: Callable[[], Coroutine[Any, Any, T]]) -> T:
+    """
+    Returns `await fn()`, sharing the call with every task of the event loop
+    asking for the same `key` at the same time.
+    """
+    return await _async_single_flight.do(key, fn)
@@ -1,11 +1,53 @@
+import math
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
 from PIL import Image
 
+# NumPy is optional, it's only needed to reproject panoramas.
+if TYPE_CHECKING:
+    import numpy as np  # pyright: ignore[reportMissingImports]
+
+# Pixels this dark or darker count as black.
+BLACK_LUMINANCE = 4
+
+# A 640x640 sampling map takes about 13 MB, a 1024x1024 one 32 MB.
+SAMPLING_MAP_CACHE_BYTES = 256 * 1024**2
+
+_sampling_maps: OrderedDict[
+    tuple[tuple[int, int], tuple[int, int], float, float], "SamplingMap"
+] = OrderedDict()
+_sampling_maps_bytes = 0
+_sampling_maps_lock = threading.Lock()
+
+# (heading, pitch) of the faces of a cubemap.
+CUBE_FACES = {
+    "front": (0, 0),
+    "right": (90, 0),
+    "back": (180, 0),
+    "left": (-90, 0),
+    "up": (0, 90),
+    "down": (0, -90),
+}
+
+
+def get_non_black_bbox(img: Image.Image) -> tuple[int, int, int, int] | None:
+    """
+    Returns the bounding box `(left, upper, right, lower)` of the pixels
+    brighter than `BLACK_LUMINANCE`, or `None` if the image is all black.
+    """
+    table = [0] * (BLACK_LUMINANCE + 1) + [255] * (255 - BLACK_LUMINANCE)
+    return img.convert("L").point(table).getbbox()
+
 
 def get_pixel_from_bw_image(img: Image.Image, x: int, y: int) -> float:
     """
     Get the pixel value from a black and white image.
     """
-    bw_img = img.convert("L")
+    bw_img = img if img.mode == "L" else img.convert("L")
     pixel = bw_img.getpixel((x, y))
     if pixel is None or isinstance(pixel, tuple):
         raise ValueError("Invalid pixel value")
@@ -20,71 +62,16 @@ def crop_bottom_and_right_black_border(img: Image.Image) -> Image.Image:
     he dimensions of the panorama are not always correct / multiple of
     512, a common issue with user-contributed panoramas.
 
-    The implementation is not perfect, but it works for most cases.
+    Everything below the last row and right of the last column with a pixel
+    brighter than `BLACK_LUMINANCE` is cropped.
     """
     (width, height) = img.size
-    bw_img = img.convert("L")
-    black_luminance = 4
-
-    # Find the bottom of the panorama
-    pixel_cursor = (0, height - 1)
-    valid_max_y = height - 1
-    while pixel_cursor[0] < width and pixel_cursor[1] >= 0:
-        pixel_color = get_pixel_from_bw_image(bw_img, *pixel_cursor)
-
-        if pixel_color > black_luminance:
-            # Found a non-black pixel
-            # Double check if all the pixels below this one are black
-            all_pixels_below = list(
-                bw_img.crop((0, pixel_cursor[1] + 1, width, height)).getdata()
-            )
-            all_black = True
-            for pixel in all_pixels_below:
-                if pixel > black_luminance:
-                    all_black = False
-
-            if all_black:
-                valid_max_y = pixel_cursor[1]
-                break
-            else:
-                # A false positive, probably the actual valid bottom pixel is
-                # very close to black Reset the cursor to the next vertical
-                # line to the right
-                pixel_cursor = (pixel_cursor[0] + 1, height - 1)
-
-        else:
-            pixel_cursor = (pixel_cursor[0], pixel_cursor[1] - 1)
-
-    # Find the right of the panorama
-    pixel_cursor = (width - 1, 0)
-    valid_max_x = width - 1
-    while pixel_cursor[1] < height and pixel_cursor[0] >= 0:
-        pixel_color = get_pixel_from_bw_image(bw_img, *pixel_cursor)
-
-        if pixel_color > black_luminance:
-            # Found a non-black pixel
-            # Double check if all the pixels to the right of this one are black
-            all_pixels_to_the_right = list(
-                bw_img.crop((pixel_cursor[0] + 1, 0, width, height)).getdata()
-            )
-            all_black = True
-            for pixel in all_pixels_to_the_right:
-                if pixel > black_luminance:
-                    all_black = False
-            if all_black:
-                valid_max_x = pixel_cursor[0]
-                break
-            else:
-                # A false positive, probably the actual valid right pixel
-                # is very close to black Reset the cursor to the next
-                # horizontal line below
-                pixel_cursor = (width - 1, pixel_cursor[1] + 1)
-
-        else:
-            pixel_cursor = (pixel_cursor[0] - 1, pixel_cursor[1])
-
-    valid_height = valid_max_y + 1
-    valid_width = valid_max_x + 1
+    bbox = get_non_black_bbox(img)
+    if bbox is None:
+        # All black, there's nothing to crop to
+        return img
+
+    _, _, valid_width, valid_height = bbox
 
     if valid_height == height and valid_width == width:
         # No black border found
@@ -95,3 +82,263 @@ def crop_bottom_and_right_black_border(img: Image.Image) -> Image.Image:
         f" Cropping from {width}x{height} to {valid_width}x{valid_height}"
     )
     return img.crop((0, 0, valid_width, valid_height))
+
+
+def perspective_to_equirectangular(
+    heading: float, pitch: float, fov: float, size: tuple[int, int]
+) -> tuple["np.ndarray", "np.ndarray"]:
+    """
+    Works out which point of an equirectangular panorama each pixel of a
+    perspective view shows. The view looks `heading` degrees to the right of
+    the middle of the panorama and `pitch` degrees up, `fov` degrees wide and
+    `size` `(width, height)` pixels.
+
+    Returns two `(height, width)` arrays `u` and `v`, the point's position as
+    a fraction of the panorama's width from its left edge and of its height
+    from its top edge.
+    """
+    import numpy as np  # pyright: ignore[reportMissingImports]
+
+    width, height = size
+    focal = width / 2 / math.tan(math.radians(fov) / 2)
+    x, y = np.meshgrid(
+        np.arange(width, dtype=np.float32) - (width - 1) / 2,
+        (height - 1) / 2 - np.arange(height, dtype=np.float32),
+    )
+    z = np.full_like(x, focal)
+
+    # Tilt the rays up by the pitch, then turn them right by the heading.
+    cos_pitch, sin_pitch = math.cos(math.radians(pitch)), math.sin(math.radians(pitch))
+    y, z = y * cos_pitch + z * sin_pitch, z * cos_pitch - y * sin_pitch
+    cos_head, sin_head = (
+        math.cos(math.radians(heading)),
+        math.sin(math.radians(heading)),
+    )
+    x, z = x * cos_head + z * sin_head, z * cos_head - x * sin_head
+
+    yaw = np.arctan2(x, z)
+    elevation = np.arctan2(y, np.hypot(x, z))
+    u = (0.5 + yaw / (2 * math.pi)) % 1.0
+    v = 0.5 - elevation / math.pi
+    return u, v
+
+
+def bilinear_coordinates(
+    u: "np.ndarray", v: "np.ndarray", width: int, height: int
+) -> tuple[
+    tuple["np.ndarray", "np.ndarray"],
+    tuple["np.ndarray", "np.ndarray"],
+    "np.ndarray",
+    "np.ndarray",
+]:
+    """
+    Returns the columns `(x0, x1)` and rows `(y0, y1)` of the four pixels of a
+    `width` by `height` panorama around each point `(u, v)`, and how far
+    `(fx, fy)` each point is from the first of them. Columns wrap around the
+    panorama's sides, rows stop at its top and bottom.
+    """
+    import numpy as np  # pyright: ignore[reportMissingImports]
+
+    x = u * width - 0.5
+    y = v * height - 0.5
+    x0, y0 = np.floor(x), np.floor(y)
+    fx, fy = (x - x0).astype(np.float32), (y - y0).astype(np.float32)
+    x0 = x0.astype(np.int64)
+    y0 = y0.astype(np.int64)
+    return (
+        (x0 % width, (x0 + 1) % width),
+        (np.clip(y0, 0, height - 1), np.clip(y0 + 1, 0, height - 1)),
+        fx,
+        fy,
+    )
+
+
+@dataclass(frozen=True, eq=False)
+class SamplingMap:
+    """
+    For each output pixel, where in the panorama its four neighbours are,
+    as flat pixel indices, and how much each of them weighs.
+    """
+
+    indices: "np.ndarray"
+    weights: "np.ndarray"
+
+    def apply(self, panorama: "np.ndarray") -> "np.ndarray":
+        """
+        Samples a `(height, width, 3)` uint8 panorama array, returns the
+        output as another.
+        """
+        import numpy as np  # pyright: ignore[reportMissingImports]
+
+        pixels = panorama.reshape(-1, panorama.shape[-1])
+        # np.take gathers rows a few times faster than fancy indexing.
+        output = np.take(pixels, self.indices[0], axis=0) * self.weights[0]
+        for indices, weights in zip(self.indices[1:], self.weights[1:], strict=True):
+            output += np.take(pixels, indices, axis=0) * weights
+        return np.rint(output, out=output).astype(np.uint8)
+
+    @property
+    def nbytes(self) -> int:
+        return self.indices.nbytes + self.weights.nbytes
+
+    def shifted(self, columns: int, width: int) -> "SamplingMap":
+        """
+        Returns the map of the same view turned `columns` pixels to the right
+        in a panorama `width` pixels wide.
+        """
+        import numpy as np  # pyright: ignore[reportMissingImports]
+
+        rows, cols = np.divmod(self.indices, width)
+        cols += columns
+        cols %= width
+        rows *= width
+        rows += cols
+        return SamplingMap(indices=rows, weights=self.weights)
+
+
+def make_sampling_map(
+    input_size: tuple[int, int],
+    output_size: tuple[int, int],
+    fov: float,
+    heading: float = 0,
+    pitch: float = 0,
+) -> SamplingMap:
+    """
+    Works out the map that reprojects an `input_size` equirectangular
+    panorama into an `output_size` perspective view.
+    """
+    import numpy as np  # pyright: ignore[reportMissingImports]
+
+    width, height = input_size
+    u, v = perspective_to_equirectangular(heading, pitch, fov, output_size)
+    (x0, x1), (y0, y1), fx, fy = bilinear_coordinates(u, v, width, height)
+    indices = np.stack(
+        [y0 * width + x0, y0 * width + x1, y1 * width + x0, y1 * width + x1]
+    )
+    weights = np.stack([(1 - fx) * (1 - fy), fx * (1 - fy), (1 - fx) * fy, fx * fy])[
+        ..., None
+    ]
+    # Every panorama fits in 32 bit indices, which halves the map's size.
+    return SamplingMap(indices=indices.astype(np.int32), weights=weights)
+
+
+def get_sampling_map(
+    input_size: tuple[int, int],
+    output_size: tuple[int, int],
+    fov: float,
+    heading: float = 0,
+    pitch: float = 0,
+) -> SamplingMap:
+    """
+    Returns the map that reprojects an `input_size` equirectangular panorama
+    into an `output_size` perspective view.
+
+    Turning the view only shifts the columns it samples, so maps are cached
+    per panorama size, view size, field of view and pitch, and the heading is
+    applied as a shift of whole panorama pixels. That rounds it to the
+    nearest `360 / width` degrees, under one pixel of the panorama. The
+    cache is bounded to `SAMPLING_MAP_CACHE_BYTES`, least recently used maps
+    are dropped first.
+    """
+    global _sampling_maps_bytes
+
+    key = (input_size, output_size, fov, pitch)
+    with _sampling_maps_lock:
+        sampling_map = _sampling_maps.get(key)
+        if sampling_map is not None:
+            _sampling_maps.move_to_end(key)
+
+    if sampling_map is None:
+        sampling_map = make_sampling_map(input_size, output_size, fov, 0, pitch)
+        with _sampling_maps_lock:
+            if key not in _sampling_maps and (
+                sampling_map.nbytes <= SAMPLING_MAP_CACHE_BYTES
+            ):
+                _sampling_maps[key] = sampling_map
+                _sampling_maps_bytes += sampling_map.nbytes
+                while _sampling_maps_bytes > SAMPLING_MAP_CACHE_BYTES:
+                    _, dropped = _sampling_maps.popitem(last=False)
+                    _sampling_maps_bytes -= dropped.nbytes
+
+    width = input_size[0]
+    columns = round(heading / 360 * width) % width
+    if columns == 0:
+        return sampling_map
+    return sampling_map.shifted(columns, width)
+
+
+def clear_sampling_maps() -> None:
+    """
+    Empties the sampling map cache.
+    """
+    global _sampling_maps_bytes
+    with _sampling_maps_lock:
+        _sampling_maps.clear()
+        _sampling_maps_bytes = 0
+
+
+def to_array(panorama: "Image.Image | np.ndarray") -> "np.ndarray":
+    import numpy as np  # pyright: ignore[reportMissingImports]
+
+    if isinstance(panorama, Image.Image):
+        return np.asarray(panorama.convert("RGB"))
+    return panorama
+
+
+def reproject_perspectives(
+    panorama: "Image.Image | np.ndarray",
+    headings: Iterable[float],
+    pitch: float = 0,
+    fov: float = 90,
+    size: tuple[int, int] = (640, 640),
+) -> list[Image.Image]:
+    """
+    Cuts perspective views out of an equirectangular panorama, one for each
+    of `headings`, in degrees to the right of the panorama's middle. The
+    views are all `fov` degrees wide, `size` pixels and `pitch` degrees up.
+
+    The panorama can be a PIL image or an array, e.g. from
+    `get_panorama_array`. It's converted once for all the views, and each
+    view is a single vectorised lookup through a cached `SamplingMap`.
+    Needs NumPy.
+    """
+    array = to_array(panorama)
+    input_size = (array.shape[1], array.shape[0])
+    return [
+        Image.fromarray(
+            get_sampling_map(input_size, size, fov, heading, pitch).apply(array)
+        )
+        for heading in headings
+    ]
+
+
+def reproject_perspective(
+    panorama: "Image.Image | np.ndarray",
+    heading: float = 0,
+    pitch: float = 0,
+    fov: float = 90,
+    size: tuple[int, int] = (640, 640),
+) -> Image.Image:
+    """
+    Cuts one perspective view out of an equirectangular panorama, like
+    `reproject_perspectives`.
+    """
+    return reproject_perspectives(panorama, [heading], pitch, fov, size)[0]
+
+
+def reproject_cubemap(
+    panorama: "Image.Image | np.ndarray", face_size: int = 1024
+) -> dict[str, Image.Image]:
+    """
+    Turns an equirectangular panorama into the six `face_size` square faces
+    of a cubemap, keyed by the names in `CUBE_FACES`. Needs NumPy.
+    """
+    array = to_array(panorama)
+    input_size = (array.shape[1], array.shape[0])
+    size = (face_size, face_size)
+    return {
+        name: Image.fromarray(
+            get_sampling_map(input_size, size, 90, heading, pitch).apply(array)
+        )
+        for name, (heading, pitch) in CUBE_FACES.items()
+    }
@@ -0,0 +1,213 @@
+import asyncio
+import concurrent.futures
+import math
+from io import BytesIO
+from typing import TYPE_CHECKING
+
+import httpx
+import requests
+from PIL import Image
+
+from .cache import TileCache
+from .client import get_async_client, get_session
+from .download import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_MAX_RETRIES,
+    MIN_ZOOM,
+    TILE_SIZE,
+    TileInfo,
+    fetch_panorama_tile_bytes,
+    fetch_panorama_tile_bytes_async,
+    get_width_and_height_from_zoom,
+    make_download_url,
+    panorama_width,
+)
+from .retry import RetryPolicy
+from .tools import bilinear_coordinates, perspective_to_equirectangular
+
+# NumPy is optional, it's only needed to render views.
+if TYPE_CHECKING:
+    import numpy as np  # pyright: ignore[reportMissingImports]
+
+DEFAULT_FOV = 90
+DEFAULT_VIEW_SIZE = (640, 640)
+# The highest zoom level most panoramas have.
+DEFAULT_MAX_ZOOM = 5
+
+
+def pick_view_zoom(fov: float, width: int, max_zoom: int = DEFAULT_MAX_ZOOM) -> int:
+    """
+    Returns the lowest zoom level, up to `max_zoom`, with at least as many
+    pixels per degree as the middle of a view `fov` degrees and `width`
+    pixels wide.
+    """
+    focal = width / 2 / math.tan(math.radians(fov) / 2)
+    zoom = MIN_ZOOM
+    while zoom < max_zoom and panorama_width(zoom) / (2 * math.pi) < focal:
+        zoom += 1
+    return zoom
+
+
+class ViewSampler:
+    """
+    The panorama pixels a view is interpolated from at a zoom level, and the
+    tiles they are in.
+    """
+
+    def __init__(self, u: "np.ndarray", v: "np.ndarray", zoom: int):
+        import numpy as np  # pyright: ignore[reportMissingImports]
+
+        self.zoom = zoom
+        grid_width, grid_height = get_width_and_height_from_zoom(zoom)
+        width, height = grid_width * TILE_SIZE, grid_height * TILE_SIZE
+
+        # Bilinear interpolation between the four pixels around each point.
+        self.xs, self.ys, fx, fy = bilinear_coordinates(u, v, width, height)
+        self.fx, self.fy = fx[..., None], fy[..., None]
+
+        needed = np.zeros((grid_height, grid_width), dtype=bool)
+        for xs in self.xs:
+            for ys in self.ys:
+                needed[ys // TILE_SIZE, xs // TILE_SIZE] = True
+        self.tiles = [
+            (int(tx), int(ty)) for ty, tx in zip(*np.nonzero(needed), strict=True)
+        ]
+
+    def render(self, tiles: dict[tuple[int, int], Image.Image]) -> Image.Image:
+        """
+        Renders the view from the decoded `tiles`, keyed by `(x, y)`.
+        """
+        import numpy as np  # pyright: ignore[reportMissingImports]
+
+        grid_width, grid_height = get_width_and_height_from_zoom(self.zoom)
+        stack = np.zeros((len(self.tiles), TILE_SIZE, TILE_SIZE, 3), dtype=np.uint8)
+        index = np.zeros((grid_height, grid_width), dtype=np.int64)
+        for i, (tx, ty) in enumerate(self.tiles):
+            image = tiles[tx, ty].convert("RGB")
+            stack[i, : image.height, : image.width] = np.asarray(image)
+            index[ty, tx] = i
+
+        def pixels(xs: "np.ndarray", ys: "np.ndarray") -> "np.ndarray":
+            tile = index[ys // TILE_SIZE, xs // TILE_SIZE]
+            return stack[tile, ys % TILE_SIZE, xs % TILE_SIZE].astype(np.float32)
+
+        (x0, x1), (y0, y1) = self.xs, self.ys
+        top = pixels(x0, y0) * (1 - self.fx) + pixels(x1, y0) * self.fx
+        bottom = pixels(x0, y1) * (1 - self.fx) + pixels(x1, y1) * self.fx
+        view = top * (1 - self.fy) + bottom * self.fy
+        return Image.fromarray(np.rint(view).astype(np.uint8))
+
+    def tile_info(self, pano_id: str) -> list[TileInfo]:
+        return [
+            TileInfo(
+                x=x,
+                y=y,
+                fileurl=make_download_url(pano_id=pano_id, zoom=self.zoom, x=x, y=y),
+                pano_id=pano_id,
+                zoom=self.zoom,
+            )
+            for x, y in self.tiles
+        ]
+
+
+def make_view_sampler(
+    heading: float,
+    pitch: float,
+    fov: float,
+    size: tuple[int, int],
+    zoom: int | None = None,
+) -> ViewSampler:
+    """
+    Returns the sampler of a view at `zoom`, or at the lowest zoom level
+    sharp enough for it.
+    """
+    if not 0 < fov < 180:
+        raise ValueError("fov must be between 0 and 180 degrees")
+    if zoom is None:
+        zoom = pick_view_zoom(fov, size[0])
+    u, v = perspective_to_equirectangular(heading, pitch, fov, size)
+    return ViewSampler(u, v, zoom)
+
+
+def get_panorama_view(
+    pano_id: str,
+    heading: float = 0,
+    pitch: float = 0,
+    fov: float = DEFAULT_FOV,
+    size: tuple[int, int] = DEFAULT_VIEW_SIZE,
+    zoom: int | None = None,
+    multi_threaded: bool = False,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    session: requests.Session | None = None,
+    cache: TileCache | None = None,
+    retry: RetryPolicy | None = None,
+) -> Image.Image:
+    """
+    Renders a perspective view of a panorama, like `get_streetview` but
+    locally and without an API key.
+
+    The view looks `heading` degrees to the right of the middle of the
+    panorama, which faces the way the camera was travelling, and `pitch`
+    degrees up. Subtract a `Panorama`'s `heading` from a compass bearing to
+    get the view's heading. It is `fov` degrees wide and `size` pixels.
+
+    Only the tiles the view overlaps are downloaded, at the lowest zoom level
+    with enough detail for it, or at `zoom`. A 90 degree view at the default
+    size is made at zoom 2 from four to six of its eight tiles. Needs NumPy.
+    """
+    sampler = make_view_sampler(heading, pitch, fov, size, zoom)
+    session = session or get_session()
+
+    def fetch(info: TileInfo) -> Image.Image:
+        data = fetch_panorama_tile_bytes(info, max_retries, session, cache, retry)
+        return Image.open(BytesIO(data))
+
+    infos = sampler.tile_info(pano_id)
+    if multi_threaded:
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            images = list(executor.map(fetch, infos))
+    else:
+        images = [fetch(info) for info in infos]
+    return sampler.render(
+        {(info.x, info.y): image for info, image in zip(infos, images, strict=True)}
+    )
+
+
+async def get_panorama_view_async(
+    pano_id: str,
+    heading: float = 0,
+    pitch: float = 0,
+    fov: float = DEFAULT_FOV,
+    size: tuple[int, int] = DEFAULT_VIEW_SIZE,
+    zoom: int | None = None,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    client: httpx.AsyncClient | None = None,
+    cache: TileCache | None = None,
+    retry: RetryPolicy | None = None,
+) -> Image.Image:
+    """
+    Asynchronously renders a perspective view of a panorama, like
+    `get_panorama_view`, with up to `concurrency` tile requests in flight.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    sampler = make_view_sampler(heading, pitch, fov, size, zoom)
+    client = client or get_async_client()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(info: TileInfo) -> Image.Image:
+        async with semaphore:
+            data = await fetch_panorama_tile_bytes_async(
+                info, max_retries, client, cache, retry
+            )
+        return Image.open(BytesIO(data))
+
+    infos = sampler.tile_info(pano_id)
+    images = await asyncio.gather(*(fetch(info) for info in infos))
+    # Interpolating is CPU bound, keep it off the event loop.
+    return await asyncio.to_thread(
+        sampler.render,
+        {(info.x, info.y): image for info, image in zip(infos, images, strict=True)},
+    )
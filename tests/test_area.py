@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+import streetview.area
+from streetview import search_area
+from streetview.area import Cell, point_in_polygon, to_polygon
+from streetview.search import Panorama
+
+
+def make_panorama(pano_id: str, lat: float, lon: float) -> Panorama:
+    return Panorama(
+        pano_id=pano_id,
+        lat=lat,
+        lon=lon,
+        heading=0,
+        pitch=None,
+        roll=None,
+        date=None,
+        elevation=None,
+    )
+
+
+# A street in the south west corner of the area and one outside it.
+STREET = [make_panorama(f"street{i}", 0.0001, 0.0001 * i) for i in range(1, 4)]
+OUTSIDE = make_panorama("outside", 0.0001, 0.01)
+AREA = (0.0, 0.0, 0.004, 0.004)
+
+
+@pytest.fixture
+def searched_cells(monkeypatch) -> list[Cell]:
+    cells = []
+
+    def search_cell(cell: Cell, session=None) -> list[Panorama]:
+        cells.append(cell)
+        found = [p for p in STREET if cell.contains(p.lat, p.lon)]
+        # Like the real service, a hit also returns the panoramas linked to it.
+        return [*found, OUTSIDE] if found else []
+
+    monkeypatch.setattr(streetview.area, "search_cell", search_cell)
+    return cells
+
+
+def test_that_every_panorama_in_the_area_is_found_once(searched_cells):
+    panos = list(search_area(AREA, spacing=50, refinements=2))
+    assert sorted(p.pano_id for p in panos) == ["street1", "street2", "street3"]
+
+
+def test_that_empty_cells_are_not_refined(searched_cells):
+    list(search_area(AREA, spacing=50, refinements=2))
+    coarse = [cell for cell in searched_cells if cell.level == 2]
+    refined = [cell for cell in searched_cells if cell.level < 2]
+    # Only the one coarse cell with the street in it gets split, twice.
+    assert len(refined) == 4 + 4
+    assert len(coarse) + len(refined) == len(searched_cells)
+
+
+def test_that_queued_searches_are_dropped_when_the_caller_stops(monkeypatch):
+    cells = []
+
+    def search_cell(cell: Cell, session=None) -> list[Panorama]:
+        cells.append(cell)
+        # The first search comes back straight away, the others take a while.
+        if len(cells) > 1:
+            time.sleep(0.1)
+        return [make_panorama(f"pano{len(cells)}", cell.lat, cell.lon)]
+
+    monkeypatch.setattr(streetview.area, "search_cell", search_cell)
+    # Two searches run and two more are queued.
+    panos = search_area(AREA, spacing=50, refinements=0, concurrency=2)
+    next(panos)
+    panos.close()
+    time.sleep(0.3)
+    assert len(cells) < 4
+
+
+def test_that_a_bbox_becomes_a_polygon():
+    assert to_polygon((0, 1, 2, 3)) == [(0, 1), (0, 3), (2, 3), (2, 1)]
+
+
+def test_point_in_polygon():
+    triangle = [(0.0, 0.0), (0.0, 1.0), (1.0, 0.0)]
+    assert point_in_polygon(0.2, 0.2, triangle)
+    assert not point_in_polygon(0.8, 0.8, triangle)
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import os
+import warnings
+
+import pytest
+from PIL import Image
+
+from streetview.cache import PanoramaStore, TileCache
+
+
+def test_that_a_cached_tile_is_returned(tmp_path):
+    cache = TileCache(tmp_path)
+    cache.put("pano", 1, 0, 0, b"tile")
+    assert cache.get("pano", 1, 0, 0) == b"tile"
+
+
+def test_that_a_missing_tile_is_a_miss(tmp_path):
+    cache = TileCache(tmp_path)
+    assert cache.get("pano", 1, 0, 0) is None
+
+
+def test_that_the_least_recently_used_tile_is_evicted(tmp_path):
+    cache = TileCache(tmp_path, max_bytes=25)
+    cache.put("pano", 1, 0, 0, b"0" * 10)
+    cache.put("pano", 1, 1, 0, b"1" * 10)
+    os.utime(cache.path("pano", 1, 0, 0), (0, 0))
+    os.utime(cache.path("pano", 1, 1, 0), (1, 1))
+
+    # Reading the first tile makes the second one the oldest.
+    assert cache.get("pano", 1, 0, 0) is not None
+    cache.put("pano", 1, 2, 0, b"2" * 10)
+
+    assert cache.get("pano", 1, 0, 0) is not None
+    assert cache.get("pano", 1, 1, 0) is None
+    assert cache.get("pano", 1, 2, 0) is not None
+
+
+def test_that_no_temporary_files_are_left_behind(tmp_path):
+    cache = TileCache(tmp_path)
+    cache.put("pano", 1, 0, 0, b"tile")
+    files = [p.name for p in cache.path("pano", 1, 0, 0).parent.iterdir()]
+    assert files == ["0_0.jpg"]
+
+
+def test_that_a_panoramas_tiles_are_removed(tmp_path):
+    cache = TileCache(tmp_path)
+    cache.put("pano", 1, 0, 0, b"tile")
+    cache.put("pano", 2, 0, 0, b"tile")
+    cache.remove("pano", 1)
+    assert cache.get("pano", 1, 0, 0) is None
+    assert cache.get("pano", 2, 0, 0) == b"tile"
+    cache.remove("pano", 2)
+    assert not (tmp_path / "pano").exists()
+
+
+def test_that_a_stored_panorama_is_returned(tmp_path):
+    store = PanoramaStore(tmp_path, format="png")
+    image = Image.new("RGB", (8, 4), "red")
+    assert not store.has("pano", 1)
+    assert store.get("pano", 1) is None
+
+    store.put("pano", 1, image)
+
+    assert store.has("pano", 1)
+    stored = store.get("pano", 1)
+    assert stored is not None
+    assert stored.tobytes() == image.tobytes()
+    # The manifest outlives the store object.
+    store.close()
+    assert PanoramaStore(tmp_path).has("pano", 1)
+
+
+def test_that_a_stored_panorama_is_not_taken_for_a_decompression_bomb(
+    tmp_path, monkeypatch
+):
+    store = PanoramaStore(tmp_path)
+    store.put("pano", 1, Image.new("RGB", (8, 4), "red"))
+    # A zoom 5 panorama is past PIL's limit, make this one past it too.
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 10)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        stored = store.get("pano", 1)
+    assert stored is not None
+    assert stored.size == (8, 4)
+
+
+def test_that_a_stored_image_is_named_after_its_hash(tmp_path):
+    store = PanoramaStore(tmp_path)
+    path = store.put("pano", 1, Image.new("RGB", (8, 4), "red"))
+    assert path.name == hashlib.sha256(path.read_bytes()).hexdigest() + ".png"
+    assert [p.name for p in (tmp_path / "objects").iterdir()] == [path.parent.name]
+
+
+def test_that_identical_panoramas_are_stored_once(tmp_path):
+    store = PanoramaStore(tmp_path)
+    assert store.put("a", 1, Image.new("RGB", (8, 4))) == store.put(
+        "b", 1, Image.new("RGB", (8, 4))
+    )
+
+    # Replacing a panorama only deletes its old image once nothing uses it.
+    old = store.put("a", 1, Image.new("RGB", (8, 4), "red"))
+    store.put("a", 1, Image.new("RGB", (8, 4), "blue"))
+    assert store.has("b", 1)
+    assert not old.exists()
+
+
+def test_that_get_or_put_only_makes_a_panorama_once(tmp_path):
+    store = PanoramaStore(tmp_path)
+    made = []
+
+    def make():
+        made.append(True)
+        return Image.new("RGB", (8, 4))
+
+    store.get_or_put("pano", 1, make)
+    store.get_or_put("pano", 1, make)
+    assert made == [True]
+
+
+@pytest.mark.asyncio
+async def test_that_concurrent_get_or_put_async_calls_make_a_panorama_once(tmp_path):
+    store = PanoramaStore(tmp_path)
+    made = []
+
+    async def make():
+        made.append(True)
+        await asyncio.sleep(0.01)
+        return Image.new("RGB", (8, 4))
+
+    await asyncio.gather(*(store.get_or_put_async("pano", 1, make) for _ in range(4)))
+    assert made == [True]
+    assert store.has("pano", 1)
@@ -0,0 +1,49 @@
+import pytest
+
+from streetview import StreetViewClient
+from streetview.client import (
+    close_async_client,
+    get_async_client,
+    get_session,
+    make_session,
+    set_session,
+)
+
+
+def test_that_the_shared_session_is_reused():
+    assert get_session() is get_session()
+
+
+def test_that_set_session_replaces_the_shared_session():
+    session = make_session(pool_size=4)
+    set_session(session)
+    try:
+        assert get_session() is session
+    finally:
+        set_session(None)
+
+    assert get_session() is not session
+
+
+def test_that_make_session_sizes_the_connection_pool():
+    session = make_session(pool_size=4)
+    adapter = session.get_adapter("https://maps.googleapis.com")
+    assert adapter._pool_maxsize == 4  # type: ignore[attr-defined]
+
+
+@pytest.mark.asyncio
+async def test_that_the_default_async_client_is_reused_until_closed():
+    client = get_async_client()
+    assert get_async_client() is client
+
+    await close_async_client()
+    assert client.is_closed
+    assert get_async_client() is not client
+    await close_async_client()
+
+
+@pytest.mark.asyncio
+async def test_that_the_streetview_client_is_closed_by_its_context():
+    async with StreetViewClient(max_connections=4, http2=False) as client:
+        assert not client.is_closed
+    assert client.is_closed
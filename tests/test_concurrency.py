@@ -0,0 +1,74 @@
+import pytest
+
+from streetview import get_panorama
+from streetview.concurrency import AdaptiveConcurrency
+from streetview.utils import hash_image
+
+
+def test_that_the_limit_grows_by_about_one_per_round():
+    controller = AdaptiveConcurrency(initial=4)
+    for _ in range(4):
+        controller.record_success(0.1)
+    assert controller.limit == 4
+    for _ in range(2):
+        controller.record_success(0.1)
+    assert controller.limit == 5
+
+
+def test_that_the_limit_stops_at_the_maximum():
+    controller = AdaptiveConcurrency(initial=2, maximum=3)
+    for _ in range(100):
+        controller.record_success(0.1)
+    assert controller.limit == 3
+
+
+def test_that_a_failure_halves_the_limit():
+    controller = AdaptiveConcurrency(initial=8)
+    controller.record_failure()
+    assert controller.limit == 4
+
+
+def test_that_the_limit_is_only_cut_once_per_round():
+    controller = AdaptiveConcurrency(initial=8)
+    for _ in range(3):
+        controller.record_failure()
+    assert controller.limit == 4
+
+
+def test_that_the_limit_never_drops_below_the_minimum():
+    controller = AdaptiveConcurrency(initial=2, minimum=2)
+    controller.record_failure()
+    assert controller.limit == 2
+
+
+def test_that_a_slow_response_counts_as_congestion():
+    controller = AdaptiveConcurrency(initial=8, latency_tolerance=3)
+    controller.record_success(0.1)
+    controller.record_success(1.0)
+    assert controller.limit == 4
+
+
+def test_that_the_latency_baseline_follows_a_slower_network():
+    controller = AdaptiveConcurrency(initial=8, latency_tolerance=3)
+    controller.record_success(0.1)
+    # Getting slower bit by bit never looks like congestion.
+    latency = 0.1
+    for _ in range(100):
+        latency *= 1.05
+        controller.record_success(latency)
+    assert controller.limit > 8
+
+
+def test_that_bad_bounds_are_rejected():
+    with pytest.raises(ValueError):
+        AdaptiveConcurrency(initial=10, maximum=5)
+
+
+@pytest.mark.vcr()
+def test_that_the_threaded_download_adapts_its_concurrency():
+    controller = AdaptiveConcurrency(initial=1, latency_tolerance=1000)
+    image = get_panorama(
+        "qtpYC28QnAbluW4jTNNjSg", zoom=1, multi_threaded=True, controller=controller
+    )
+    assert hash_image(image) == "e54dcbe8ed3c7e67f87e9a378dd3b2ec"
+    assert controller.limit == 2
@@ -1,14 +1,47 @@
+import asyncio
+import concurrent.futures
+import gc
+import weakref
+import zipfile
+from io import BytesIO
+
+import httpx
 import pytest
+import requests
 from PIL import Image
 
-from streetview import get_panorama, get_panorama_async
+import streetview.download
+from streetview import (
+    StreetViewClient,
+    download_panoramas,
+    export_pyramid,
+    export_tiles,
+    get_panorama,
+    get_panorama_array,
+    get_panorama_array_async,
+    get_panorama_async,
+    save_panorama,
+    save_panorama_async,
+)
+from streetview.cache import PanoramaStore, TileCache
+from streetview.concurrency import AdaptiveConcurrency
 from streetview.download import (
+    TILE_SIZE,
+    RawTile,
+    Tile,
     TileInfo,
+    downsample_tiles,
+    draft_tile,
     fetch_panorama_tile,
+    find_edge,
     get_width_and_height_from_zoom,
+    iter_raw_tiles_async,
     iter_tile_info,
     iter_tiles,
     make_download_url,
+    new_panorama_array,
+    pick_zoom_and_scale,
+    scale_size,
 )
 from streetview.tools import crop_bottom_and_right_black_border
 from streetview.utils import hash_image
@@ -65,6 +98,78 @@ def test_that_first_tile_has_an_image():
     assert isinstance(tile.image, Image.Image)
 
 
+@pytest.mark.asyncio
+@pytest.mark.vcr()
+async def test_that_raw_tiles_are_not_decoded_async():
+    tiles = [
+        tile async for tile in iter_raw_tiles_async("qtpYC28QnAbluW4jTNNjSg", zoom=1)
+    ]
+    assert sorted((tile.x, tile.y) for tile in tiles) == [(0, 0), (1, 0)]
+    # Every tile is a JPEG, straight from the server.
+    assert all(tile.data.startswith(b"\xff\xd8") for tile in tiles)
+
+
+@pytest.mark.vcr()
+def test_that_tiles_export_to_a_directory(tmp_path):
+    path = export_tiles("qtpYC28QnAbluW4jTNNjSg", tmp_path / "tiles", zoom=1)
+    files = sorted(p.relative_to(path).as_posix() for p in path.rglob("*.jpg"))
+    assert files == ["1/0_0.jpg", "1/1_0.jpg"]
+
+
+@pytest.mark.vcr()
+def test_that_tiles_export_to_a_zip_file(tmp_path):
+    path = export_tiles("qtpYC28QnAbluW4jTNNjSg", tmp_path / "tiles.zip", zoom=1)
+    with zipfile.ZipFile(path) as archive:
+        assert sorted(archive.namelist()) == ["1/0_0.jpg", "1/1_0.jpg"]
+
+
+@pytest.mark.vcr()
+def test_that_a_pyramid_is_exported_from_one_download(tmp_path):
+    # The cassette only holds the zoom 1 tiles.
+    path = export_pyramid("qtpYC28QnAbluW4jTNNjSg", tmp_path / "tiles.zip", zoom=1)
+    with zipfile.ZipFile(path) as archive:
+        assert sorted(archive.namelist()) == ["0/0_0.jpg", "1/0_0.jpg", "1/1_0.jpg"]
+        with Image.open(BytesIO(archive.read("0/0_0.jpg"))) as image:
+            assert image.size == (512, 256)
+
+
+def test_that_a_pyramid_frees_each_level_as_it_goes(tmp_path, monkeypatch):
+    buffer = BytesIO()
+    Image.new("RGB", (TILE_SIZE, TILE_SIZE), "red").save(buffer, "jpeg")
+    tiles = [
+        RawTile(x=x, y=y, data=buffer.getvalue()) for x in range(8) for y in range(4)
+    ]
+    monkeypatch.setattr(streetview.download, "iter_raw_tiles", lambda **_: tiles)
+
+    downsample = streetview.download.downsample_tiles
+    done: list[weakref.ref] = []
+    alive = []
+
+    def spy(children, quality):
+        gc.collect()
+        alive.append(sum(ref() is not None for ref in done))
+        result = downsample(children, quality)
+        done.extend(weakref.ref(child) for child in children.values())
+        return result
+
+    monkeypatch.setattr(streetview.download, "downsample_tiles", spy)
+    export_pyramid("pano", tmp_path, zoom=3, workers=1)
+    # Children already downsampled were never kept around.
+    assert alive == [0] * 11
+
+
+def test_that_four_tiles_are_downsampled_into_one():
+    colors = {(0, 0): "red", (1, 0): "lime", (0, 1): "blue", (1, 1): "white"}
+    children = {
+        xy: Image.new("RGB", (TILE_SIZE, TILE_SIZE), c) for xy, c in colors.items()
+    }
+    tile, data = downsample_tiles(children)
+    assert tile.size == (TILE_SIZE, TILE_SIZE)
+    assert tile.getpixel((0, 0)) == (255, 0, 0)
+    assert tile.getpixel((TILE_SIZE - 1, TILE_SIZE - 1)) == (255, 255, 255)
+    assert data.startswith(b"\xff\xd8")
+
+
 @pytest.mark.vcr()
 def test_that_panorama_downloads_successfully():
     image = get_panorama(pano_id="qtpYC28QnAbluW4jTNNjSg", zoom=1)
@@ -73,6 +178,143 @@ def test_that_panorama_downloads_successfully():
     assert hash == "e54dcbe8ed3c7e67f87e9a378dd3b2ec"
 
 
+@pytest.mark.vcr()
+def test_that_panorama_saves_to_file_successfully(tmp_path):
+    path = save_panorama("qtpYC28QnAbluW4jTNNjSg", tmp_path / "pano.ppm", zoom=1)
+    with Image.open(path) as image:
+        hash = hash_image(image)
+    assert hash == "e54dcbe8ed3c7e67f87e9a378dd3b2ec"
+
+
+@pytest.mark.asyncio
+@pytest.mark.vcr()
+async def test_that_panorama_saves_to_file_successfully_async(tmp_path):
+    path = await save_panorama_async(
+        "qtpYC28QnAbluW4jTNNjSg", tmp_path / "pano.ppm", zoom=1
+    )
+    with Image.open(path) as image:
+        hash = hash_image(image)
+    assert hash == "e54dcbe8ed3c7e67f87e9a378dd3b2ec"
+
+
+@pytest.mark.vcr()
+def test_that_a_warm_cache_makes_no_requests(tmp_path):
+    # The cassette only holds one download of each tile, so a second request
+    # for any of them fails the test.
+    cache = TileCache(tmp_path)
+    for _ in range(2):
+        image = get_panorama(pano_id="qtpYC28QnAbluW4jTNNjSg", zoom=1, cache=cache)
+        hash = hash_image(image)
+        assert hash == "e54dcbe8ed3c7e67f87e9a378dd3b2ec"
+
+
+@pytest.mark.vcr()
+def test_that_concurrent_stored_panoramas_download_once(tmp_path):
+    # The cassette only holds one download of each tile, so the panorama must
+    # be downloaded once and then read from the store.
+    store = PanoramaStore(tmp_path)
+
+    def get(_):
+        return get_panorama(pano_id="qtpYC28QnAbluW4jTNNjSg", zoom=1, store=store)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        images = list(executor.map(get, range(4)))
+    images.append(get(None))
+
+    assert store.has("qtpYC28QnAbluW4jTNNjSg", 1)
+    # The stored panorama is exactly the downloaded one.
+    hashes = {hash_image(image) for image in images}
+    assert hashes == {"e54dcbe8ed3c7e67f87e9a378dd3b2ec"}
+    for options in [{"target_width": 64}, {"size": (700, 300)}, {"detect_size": True}]:
+        with pytest.raises(ValueError):
+            get_panorama(pano_id="qtpYC28QnAbluW4jTNNjSg", store=store, **options)
+
+
+@pytest.mark.asyncio
+@pytest.mark.vcr()
+async def test_that_concurrent_stored_panoramas_download_once_async(tmp_path):
+    store = PanoramaStore(tmp_path)
+    images = await asyncio.gather(
+        *(
+            get_panorama_async(pano_id="qtpYC28QnAbluW4jTNNjSg", zoom=1, store=store)
+            for _ in range(4)
+        )
+    )
+    images.append(
+        await get_panorama_async(pano_id="qtpYC28QnAbluW4jTNNjSg", zoom=1, store=store)
+    )
+    hashes = {hash_image(image) for image in images}
+    assert hashes == {"e54dcbe8ed3c7e67f87e9a378dd3b2ec"}
+
+
+@pytest.mark.vcr()
+def test_that_a_checkpoint_resumes_a_failed_download(tmp_path, monkeypatch):
+    # The cassette only holds one download of each tile, so the second attempt
+    # must only fetch the tile that failed the first time.
+    fetch = streetview.download.fetch_panorama_tile_bytes
+
+    def fail_on_second_tile(info, *args):
+        if info.x == 1:
+            raise requests.ConnectionError("Max retries exceeded.")
+        return fetch(info, *args)
+
+    checkpoint = tmp_path / "checkpoint"
+    with monkeypatch.context() as patch:
+        patch.setattr(
+            streetview.download, "fetch_panorama_tile_bytes", fail_on_second_tile
+        )
+        with pytest.raises(requests.ConnectionError):
+            get_panorama("qtpYC28QnAbluW4jTNNjSg", zoom=1, checkpoint=checkpoint)
+
+    image = get_panorama("qtpYC28QnAbluW4jTNNjSg", zoom=1, checkpoint=checkpoint)
+    assert hash_image(image) == "e54dcbe8ed3c7e67f87e9a378dd3b2ec"
+    assert not any(checkpoint.iterdir())
+
+
+@pytest.mark.vcr()
+def test_that_a_checkpoint_resumes_a_failed_multi_threaded_download(
+    tmp_path, monkeypatch
+):
+    fetch = streetview.download.fetch_panorama_tile_bytes
+
+    def fail_on_second_tile(info, *args):
+        if info.x == 1:
+            raise requests.ConnectionError("Max retries exceeded.")
+        return fetch(info, *args)
+
+    checkpoint = tmp_path / "checkpoint"
+    # One tile in flight at a time, so the first one is checkpointed before
+    # the second one fails.
+    controller = AdaptiveConcurrency(initial=1, maximum=1)
+    with monkeypatch.context() as patch:
+        patch.setattr(
+            streetview.download, "fetch_panorama_tile_bytes", fail_on_second_tile
+        )
+        with pytest.raises(Exception, match="Failed to download tile"):
+            get_panorama(
+                "qtpYC28QnAbluW4jTNNjSg",
+                zoom=1,
+                multi_threaded=True,
+                checkpoint=checkpoint,
+                controller=controller,
+            )
+
+    image = get_panorama(
+        "qtpYC28QnAbluW4jTNNjSg", zoom=1, multi_threaded=True, checkpoint=checkpoint
+    )
+    assert hash_image(image) == "e54dcbe8ed3c7e67f87e9a378dd3b2ec"
+    assert not any(checkpoint.iterdir())
+
+
+@pytest.mark.vcr()
+def test_that_an_error_response_is_not_checkpointed(tmp_path):
+    # The cassette answers the first tile with a 404.
+    checkpoint = tmp_path / "checkpoint"
+    with pytest.raises(requests.HTTPError):
+        get_panorama("z80QZ1_QgCbYwj7RrmlS0Q", zoom=1, checkpoint=checkpoint)
+    assert TileCache(checkpoint).get("z80QZ1_QgCbYwj7RrmlS0Q", 1, 0, 0) is None
+
+
 def test_that_panorama_downloads_successfully_multi_threaded():
     image = get_panorama(pano_id="qtpYC28QnAbluW4jTNNjSg", zoom=1, multi_threaded=True)
     # image.save("test_that_panorama_downloads_successfully_multi_threaded.jpg", "jpeg")
@@ -80,6 +322,19 @@ def test_that_panorama_downloads_successfully_multi_threaded():
     assert hash == "e54dcbe8ed3c7e67f87e9a378dd3b2ec"
 
 
+@pytest.mark.vcr()
+def test_that_many_panoramas_download_successfully():
+    pano_ids = ["qtpYC28QnAbluW4jTNNjSg", "wjwbitsbvzc3jEOJBUGAuA"]
+    hashes = {
+        pano_id: hash_image(image)
+        for pano_id, image in download_panoramas(pano_ids, zoom=1, concurrency=2)
+    }
+    assert hashes == {
+        "qtpYC28QnAbluW4jTNNjSg": "e54dcbe8ed3c7e67f87e9a378dd3b2ec",
+        "wjwbitsbvzc3jEOJBUGAuA": "51e07b1e48ed196f112900822e149fd3",
+    }
+
+
 @pytest.mark.asyncio
 @pytest.mark.vcr()
 async def test_that_panorama_downloads_successfully_async():
@@ -88,6 +343,95 @@ async def test_that_panorama_downloads_successfully_async():
     assert hash == "e54dcbe8ed3c7e67f87e9a378dd3b2ec"
 
 
+@pytest.mark.parametrize(
+    "target_width, zoom, scale",
+    [(100, 1, 8), (512, 1, 2), (1000, 1, 1), (3000, 3, 1), (50000, 5, 1)],
+)
+def test_that_the_cheapest_zoom_and_scale_are_picked(
+    target_width: int, zoom: int, scale: int
+):
+    assert pick_zoom_and_scale(target_width, max_zoom=5) == (zoom, scale)
+
+
+def test_that_a_jpeg_tile_is_decoded_in_draft_mode():
+    buffer = BytesIO()
+    Image.new("RGB", (TILE_SIZE, TILE_SIZE), "red").save(buffer, "jpeg")
+    tile = Tile(x=0, y=0, image=Image.open(buffer))
+    image = draft_tile(tile, scale=4)
+    # The decoder shrank the tile itself, it wasn't resized afterwards.
+    assert image is tile.image
+    assert image.size == (128, 128)
+
+
+@pytest.mark.vcr()
+def test_that_a_thumbnail_has_the_target_width():
+    # The cassette only holds zoom 1, the lowest zoom wide enough.
+    image = get_panorama("qtpYC28QnAbluW4jTNNjSg", zoom=5, target_width=256)
+    assert image.size == (256, 128)
+
+
+@pytest.mark.vcr()
+def test_that_a_thumbnails_size_is_scaled_to_its_zoom():
+    # The size is in zoom 3 pixels, the cassette only holds the two zoom 1
+    # tiles it covers.
+    assert scale_size((3000, 1500), 3, 1) == (750, 375)
+    image = get_panorama(
+        "qtpYC28QnAbluW4jTNNjSg", zoom=3, size=(4096, 2048), target_width=256
+    )
+    assert image.size == (256, 128)
+
+
+@pytest.mark.vcr()
+def test_that_panorama_downloads_into_an_array():
+    np = pytest.importorskip("numpy")
+    array = get_panorama_array(pano_id="qtpYC28QnAbluW4jTNNjSg", zoom=1)
+    assert array.shape == (512, 1024, 3)
+    assert array.dtype == np.uint8
+    assert hash_image(Image.fromarray(array)) == "e54dcbe8ed3c7e67f87e9a378dd3b2ec"
+
+
+@pytest.mark.asyncio
+@pytest.mark.vcr()
+async def test_that_panorama_downloads_into_a_memmap_async(tmp_path):
+    np = pytest.importorskip("numpy")
+    out = np.memmap(
+        tmp_path / "pano.raw", dtype=np.uint8, mode="w+", shape=(512, 1024, 3)
+    )
+    array = await get_panorama_array_async(
+        pano_id="qtpYC28QnAbluW4jTNNjSg", zoom=1, out=out
+    )
+    assert array is out
+    assert hash_image(Image.fromarray(out)) == "e54dcbe8ed3c7e67f87e9a378dd3b2ec"
+
+
+def test_that_an_array_of_the_wrong_shape_is_rejected():
+    np = pytest.importorskip("numpy")
+    with pytest.raises(ValueError):
+        new_panorama_array(1, out=np.zeros((512, 512, 3), dtype=np.uint8))
+
+
+@pytest.mark.asyncio
+@pytest.mark.vcr()
+async def test_that_panorama_downloads_successfully_async_with_client():
+    async with StreetViewClient(max_connections=2) as client:
+        image = await get_panorama_async(
+            pano_id="qtpYC28QnAbluW4jTNNjSg", zoom=1, client=client
+        )
+    hash = hash_image(image)
+    assert hash == "e54dcbe8ed3c7e67f87e9a378dd3b2ec"
+
+
+@pytest.mark.asyncio
+@pytest.mark.vcr()
+async def test_that_panorama_downloads_successfully_async_concurrently():
+    # Same panorama as the crop test below, fetched out of order.
+    image = await get_panorama_async(
+        pano_id="EVGmA-L6LuI_7-elZaDq1g", zoom=3, concurrency=4
+    )
+    hash = hash_image(image)
+    assert hash == "84e655b41ad760c55d8e2af67b7ab416"
+
+
 @pytest.mark.vcr()
 def test_that_panorama_downloads_successfully_crop_bottom_right_border():
     # this pano_id has a black border on the bottom right
@@ -104,6 +448,38 @@ def test_that_panorama_downloads_successfully_crop_bottom_right_border():
     assert hash == "e42d2d6207cd09d7b6d10d49c0a8305b"
 
 
+@pytest.mark.vcr()
+def test_that_only_real_tiles_are_downloaded(tmp_path, vcr_cassette):
+    # Same panorama as above, the probed tiles are reused through the cache.
+    image = get_panorama(
+        pano_id="EVGmA-L6LuI_7-elZaDq1g",
+        zoom=3,
+        detect_size=True,
+        cache=TileCache(tmp_path),
+    )
+    hash = hash_image(image)
+    assert hash == "e42d2d6207cd09d7b6d10d49c0a8305b"
+    # The 7x4 tiles of the picture, plus the probe of the last column which
+    # is past its edge.
+    assert vcr_cassette.play_count == 7 * 4 + 1
+
+
+@pytest.mark.parametrize(
+    "tiles, pixels", [(8, 8 * TILE_SIZE), (5, 4 * TILE_SIZE + 100)]
+)
+def test_that_find_edge_finds_the_last_tile(tiles: int, pixels: int):
+    probed = []
+
+    def probe(i: int):
+        probed.append(i)
+        if i >= tiles:
+            return None
+        return (0, 0, 100 if i == tiles - 1 and tiles < 8 else TILE_SIZE, TILE_SIZE)
+
+    assert find_edge(8, probe, 2) == pixels
+    assert len(probed) <= 4
+
+
 @pytest.mark.vcr()
 def test_on_image_that_throws_UnidentifiedImageError():
     image = get_panorama(pano_id="wjwbitsbvzc3jEOJBUGAuA", zoom=1)
@@ -118,3 +494,28 @@ def test_on_image_that_throws_UnidentifiedImageError_2():
     # image.save("test_that_panorama_downloads_successfully.jpg", "jpeg")
     hash = hash_image(image)
     assert hash == "2cb63ac70e437b828bc64cdf71cd6fdd"
+
+
+@pytest.mark.asyncio
+async def test_that_closing_the_async_tile_iterator_stops_its_requests():
+    cancelled = []
+
+    class SlowClient:
+        async def get(self, url, **kwargs):
+            if "x=0&y=0" not in url:
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    cancelled.append(url)
+                    raise
+            return httpx.Response(
+                200, content=b"tile", request=httpx.Request("GET", url)
+            )
+
+    tiles = iter_raw_tiles_async("pano", zoom=2, client=SlowClient())  # pyright: ignore[reportArgumentType]
+    tile = await anext(tiles)
+    assert tile.data == b"tile"
+    await tiles.aclose()
+    # Give the cancelled requests a turn of the event loop to unwind.
+    await asyncio.sleep(0.01)
+    assert len(cancelled) == 7
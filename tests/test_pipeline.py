@@ -0,0 +1,70 @@
+import concurrent.futures
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from streetview import save_panoramas_async
+from streetview.download import RawTile
+from streetview.pipeline import stitch_panorama
+from streetview.utils import hash_image
+
+
+def make_tile(x: int, y: int, color: str) -> RawTile:
+    image = Image.new("RGB", (512, 512), color)
+    buffer = BytesIO()
+    image.save(buffer, format="png")
+    return RawTile(x=x, y=y, data=buffer.getvalue())
+
+
+def test_that_tiles_are_stitched_into_a_file(tmp_path):
+    tiles = [make_tile(0, 0, "red"), make_tile(1, 0, "blue")]
+    path = stitch_panorama(tiles, zoom=1, path=tmp_path / "pano.png")
+    with Image.open(path) as image:
+        assert image.size == (1024, 512)
+        assert image.getpixel((0, 0)) == (255, 0, 0)
+        assert image.getpixel((1023, 0)) == (0, 0, 255)
+
+
+def test_that_the_black_border_can_be_cropped(tmp_path):
+    tiles = [make_tile(0, 0, "red"), make_tile(1, 0, "black")]
+    path = stitch_panorama(tiles, zoom=1, path=tmp_path / "pano.png", crop=True)
+    with Image.open(path) as image:
+        assert image.size == (512, 512)
+
+
+@pytest.mark.asyncio
+@pytest.mark.vcr()
+async def test_that_panoramas_are_stitched_in_worker_processes(tmp_path):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        results = [
+            result
+            async for result in save_panoramas_async(
+                ["qtpYC28QnAbluW4jTNNjSg"],
+                tmp_path,
+                zoom=1,
+                suffix=".png",
+                executor=executor,
+            )
+        ]
+    assert results == [
+        ("qtpYC28QnAbluW4jTNNjSg", tmp_path / "qtpYC28QnAbluW4jTNNjSg.png")
+    ]
+    with Image.open(results[0][1]) as image:
+        assert hash_image(image) == "e54dcbe8ed3c7e67f87e9a378dd3b2ec"
+
+
+@pytest.mark.asyncio
+async def test_that_bad_arguments_are_rejected_before_starting_a_pool(
+    tmp_path, monkeypatch
+):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("a process pool was started")
+
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", no_pool)
+    with pytest.raises(ValueError):
+        async for _ in save_panoramas_async(["pano"], tmp_path, downloads=0):
+            pass
+    with pytest.raises(ValueError):
+        async for _ in save_panoramas_async(["pano"], tmp_path, suffix=".txt"):
+            pass
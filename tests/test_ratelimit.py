@@ -0,0 +1,72 @@
+import pytest
+
+from streetview import search_panoramas
+from streetview.download import iter_raw_tiles
+from streetview.ratelimit import (
+    FileRateLimiter,
+    RateLimiter,
+    set_rate_limiter,
+    take_token,
+)
+
+
+class CountingRateLimiter(RateLimiter):
+    def __init__(self):
+        super().__init__(rate=1000)
+        self.hosts: list[str] = []
+
+    def reserve(self, host: str) -> float:
+        self.hosts.append(host)
+        return super().reserve(host)
+
+
+@pytest.fixture
+def rate_limiter():
+    rate_limiter = CountingRateLimiter()
+    set_rate_limiter(rate_limiter)
+    yield rate_limiter
+    set_rate_limiter(None)
+
+
+def test_that_a_full_bucket_does_not_wait():
+    assert take_token(tokens=5, elapsed=0, rate=1, burst=5) == (4, 0)
+
+
+def test_that_an_empty_bucket_waits_for_a_token():
+    tokens, wait = take_token(tokens=0, elapsed=0, rate=2, burst=5)
+    assert tokens == -1
+    assert wait == 0.5
+
+
+def test_that_waiting_requests_queue_up():
+    rate_limiter = RateLimiter(rate=10, burst=1)
+    waits = [rate_limiter.reserve("example.com") for _ in range(3)]
+    assert waits[0] == 0
+    assert waits[1] == pytest.approx(0.1, abs=0.01)
+    assert waits[2] == pytest.approx(0.2, abs=0.01)
+
+
+def test_that_hosts_have_their_own_buckets():
+    rate_limiter = RateLimiter(rate=1, burst=1)
+    assert rate_limiter.reserve("a.example.com") == 0
+    assert rate_limiter.reserve("b.example.com") == 0
+
+
+def test_that_file_rate_limiters_share_a_budget(tmp_path):
+    # Two limiters on one directory stand in for two processes.
+    first = FileRateLimiter(tmp_path, rate=10, burst=1)
+    second = FileRateLimiter(tmp_path, rate=10, burst=1)
+    assert first.reserve("example.com") == 0
+    assert second.reserve("example.com") == pytest.approx(0.1, abs=0.01)
+
+
+@pytest.mark.vcr()
+def test_that_searches_wait_for_the_rate_limiter(rate_limiter):
+    search_panoramas(lat=28.092432, lon=-34.399243)
+    assert rate_limiter.hosts == ["maps.googleapis.com"]
+
+
+@pytest.mark.vcr()
+def test_that_tile_downloads_wait_for_the_rate_limiter(rate_limiter):
+    next(iter_raw_tiles("z80QZ1_QgCbYwj7RrmlS0Q", zoom=1))
+    assert rate_limiter.hosts == ["streetviewpixels-pa.googleapis.com"]
@@ -0,0 +1,112 @@
+import asyncio
+import dataclasses
+import time
+from email.utils import formatdate
+
+import httpx
+import pytest
+import requests
+
+from streetview import RetryPolicy
+from streetview.cache import TileCache
+from streetview.download import (
+    TileInfo,
+    fetch_panorama_tile_bytes,
+    fetch_panorama_tile_bytes_async,
+    make_download_url,
+)
+from streetview.retry import parse_retry_after
+
+THROTTLED_TILE = TileInfo(
+    x=0, y=0, fileurl=make_download_url("z80QZ1_QgCbYwj7RrmlS0Q", zoom=1, x=0, y=0)
+)
+
+
+def test_that_the_backoff_doubles_up_to_the_cap():
+    retry = RetryPolicy(backoff=1, max_backoff=5, jitter=False)
+    assert [retry.delay(attempt) for attempt in range(5)] == [1, 2, 4, 5, 5]
+
+
+def test_that_jitter_stays_under_the_backoff():
+    retry = RetryPolicy(backoff=1)
+    assert all(0 <= retry.delay(3) <= 8 for _ in range(100))
+
+
+def test_that_retry_after_takes_precedence():
+    retry = RetryPolicy(backoff=1, max_backoff=60)
+    assert retry.delay(0, "12") == 12
+    assert retry.delay(0, "600") == 60
+
+
+def test_that_retry_after_can_be_a_date():
+    wait = parse_retry_after(formatdate(time.time() + 30, usegmt=True))
+    assert wait is not None
+    assert 28 <= wait <= 30
+    assert parse_retry_after("not a date") is None
+
+
+@pytest.mark.vcr()
+def test_that_a_throttled_tile_is_retried(vcr_cassette):
+    # The cassette answers the first request with a 429.
+    retries = []
+    data = fetch_panorama_tile_bytes(
+        THROTTLED_TILE,
+        retry=RetryPolicy(backoff=0),
+        on_retry=lambda: retries.append(True),
+    )
+    assert data.startswith(b"\xff\xd8")
+    assert vcr_cassette.play_count == 2
+    assert retries == [True]
+
+
+@pytest.mark.asyncio
+@pytest.mark.vcr()
+async def test_that_a_throttled_tile_is_retried_async(vcr_cassette):
+    data = await fetch_panorama_tile_bytes_async(
+        THROTTLED_TILE, retry=RetryPolicy(backoff=0)
+    )
+    assert data.startswith(b"\xff\xd8")
+    assert vcr_cassette.play_count == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.vcr()
+async def test_that_every_caller_sharing_a_download_fills_its_cache(
+    tmp_path, vcr_cassette
+):
+    tile = dataclasses.replace(THROTTLED_TILE, pano_id="z80QZ1_QgCbYwj7RrmlS0Q", zoom=1)
+    caches = [TileCache(tmp_path / "a"), TileCache(tmp_path / "b")]
+    retries = [[], []]
+    await asyncio.gather(
+        *(
+            fetch_panorama_tile_bytes_async(
+                tile,
+                cache=cache,
+                retry=RetryPolicy(backoff=0),
+                on_retry=lambda calls=calls: calls.append(True),
+            )
+            for cache, calls in zip(caches, retries, strict=True)
+        )
+    )
+    # One download, retried once for the caller that made it.
+    assert vcr_cassette.play_count == 2
+    assert sorted(retries) == [[], [True]]
+    assert all(cache.get("z80QZ1_QgCbYwj7RrmlS0Q", 1, 0, 0) for cache in caches)
+
+
+@pytest.mark.vcr()
+def test_that_an_error_response_raises(vcr_cassette):
+    # The cassette answers with a 404, which isn't worth retrying.
+    with pytest.raises(requests.HTTPError):
+        fetch_panorama_tile_bytes(THROTTLED_TILE, retry=RetryPolicy(backoff=0))
+    assert vcr_cassette.play_count == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.vcr()
+async def test_that_an_error_response_raises_async(vcr_cassette):
+    with pytest.raises(httpx.HTTPStatusError):
+        await fetch_panorama_tile_bytes_async(
+            THROTTLED_TILE, retry=RetryPolicy(backoff=0)
+        )
+    assert vcr_cassette.play_count == 1
@@ -1,14 +1,26 @@
+import asyncio
 import os
+from pathlib import Path
 
 import pytest
+import yaml
 
 from streetview import (
     get_panorama_meta,
     search_panoramas,
+    search_panoramas_async,
+    search_panoramas_many,
     search_panoramas_url,
     search_panoramas_url_exact,
+    search_panoramas_url_exact_async,
+)
+from streetview.client import make_session
+from streetview.search import (
+    Panorama,
+    SearchCache,
+    extract_panorama_tuples,
+    extract_panoramas,
 )
-from streetview.search import Panorama
 
 GOOGLE_MAPS_API_KEY = os.environ.get("GOOGLE_MAPS_API_KEY", "NOKEY")
 
@@ -142,3 +154,133 @@ def test_search_panoramas_url_exact():
         elevation=None,
     )
     assert result == expected
+
+
+@pytest.mark.asyncio
+@pytest.mark.vcr
+async def test_search_panoramas_async():
+    result = await search_panoramas_async(lat=41.8982208, lon=12.4764804)
+    assert result[0].pano_id == "_R1mwpMkiqa2p0zp48EBJg"
+
+
+@pytest.mark.asyncio
+@pytest.mark.vcr
+async def test_that_concurrent_identical_searches_share_a_request(vcr_cassette):
+    results = await asyncio.gather(
+        *(search_panoramas_async(lat=41.8982208, lon=12.4764804) for _ in range(4))
+    )
+    assert vcr_cassette.play_count == 1
+    assert all(result[0].pano_id == "_R1mwpMkiqa2p0zp48EBJg" for result in results)
+
+
+@pytest.mark.asyncio
+@pytest.mark.vcr
+async def test_search_panoramas_url_exact_async():
+    result = await search_panoramas_url_exact_async(
+        "https://www.google.com/maps/@40.6982454,-73.980301,3a,84.9y,36.94h,99.2t"
+        "/data=!3m6!1e1!3m4!1sp-EPpErUWv2pjDvUC3N6rQ!2e0!7i16384!8i8192?entry=ttu"
+    )
+    assert result is not None
+    assert result.pano_id == "p-EPpErUWv2pjDvUC3N6rQ"
+
+
+@pytest.mark.asyncio
+@pytest.mark.vcr
+async def test_search_panoramas_many():
+    coords = [(loc["lat"], loc["lon"]) for loc in [SYDNEY, BELGRAVIA]]
+    results = [
+        (index, len(panos))
+        async for index, panos in search_panoramas_many(coords, concurrency=2)
+    ]
+    assert results == [(0, SYDNEY["result_count"]), (1, BELGRAVIA["result_count"])]
+
+
+@pytest.mark.asyncio
+@pytest.mark.vcr
+async def test_search_panoramas_many_as_completed():
+    coords = [(loc["lat"], loc["lon"]) for loc in [SYDNEY, BELGRAVIA]]
+    results = {
+        index: len(panos)
+        async for index, panos in search_panoramas_many(coords, ordered=False)
+    }
+    assert results == {0: SYDNEY["result_count"], 1: BELGRAVIA["result_count"]}
+
+
+@pytest.mark.vcr
+def test_search_with_injected_session():
+    session = make_session(pool_size=1)
+    result = search_panoramas(lat=41.8982208, lon=12.4764804, session=session)
+    assert result[0].pano_id == "_R1mwpMkiqa2p0zp48EBJg"
+
+
+@pytest.mark.vcr
+def test_that_nearby_searches_are_served_from_the_cache():
+    # The cassette only holds one search, so a second request fails the test.
+    cache = SearchCache(cell_size=1e-3)
+    first = search_panoramas(lat=41.8982208, lon=12.4764804, cache=cache)
+    second = search_panoramas(lat=41.8982301, lon=12.4764711, cache=cache)
+    assert first == second
+
+
+PANORAMA = Panorama(
+    pano_id="_R1mwpMkiqa2p0zp48EBJg",
+    lat=41.89820676786453,
+    lon=12.47644220919742,
+    heading=0.8815613985061646,
+    pitch=89.001953125,
+    roll=0.1744659692049026,
+    date="2019-08",
+    elevation=None,
+)
+
+
+def test_that_search_cache_results_expire():
+    cache = SearchCache(ttl=0)
+    cache.put(41.8982, 12.4764, [PANORAMA])
+    assert cache.get(41.8982, 12.4764) is None
+
+
+def test_that_search_cache_is_bounded():
+    cache = SearchCache(max_entries=1)
+    cache.put(1.0, 1.0, [PANORAMA])
+    cache.put(2.0, 2.0, [])
+    assert cache.get(1.0, 1.0) is None
+    assert cache.get(2.0, 2.0) == []
+
+
+def test_that_search_cache_persists(tmp_path):
+    SearchCache(path=tmp_path / "searches.db").put(41.8982, 12.4764, [PANORAMA])
+    cache = SearchCache(path=tmp_path / "searches.db")
+    assert cache.get(41.8982, 12.4764) == [PANORAMA]
+
+
+def test_that_a_persisted_search_is_only_read_with_its_cell_size(tmp_path):
+    path = tmp_path / "searches.db"
+    SearchCache(cell_size=1e-3, path=path).put(41.898, 12.476, [PANORAMA])
+    # The same cell index with cells ten times smaller is another place.
+    assert SearchCache(cell_size=1e-4, path=path).get(4.1898, 1.2476) is None
+    assert SearchCache(cell_size=1e-3, path=path).get(41.898, 12.476) == [PANORAMA]
+
+
+def load_search_payload(cassette: str) -> str:
+    path = Path(__file__).parent / "cassettes" / cassette
+    interactions = yaml.safe_load(path.read_text())["interactions"]
+    return interactions[0]["response"]["body"]["string"]
+
+
+@pytest.mark.parametrize(
+    "cassette",
+    [
+        "test_readme_search_example.yaml",
+        "test_search_where_there_are_no_dates.yaml",
+        "test_search_where_there_are_no_results.yaml",
+    ],
+)
+def test_that_fast_parsing_matches_validated_parsing(cassette: str):
+    payload = load_search_payload(cassette)
+    expected = extract_panoramas(payload)
+
+    assert extract_panoramas(payload.encode()) == expected
+    assert [Panorama(**row._asdict()) for row in extract_panorama_tuples(payload)] == (
+        expected
+    )
@@ -0,0 +1,106 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+from streetview.singleflight import AsyncSingleFlight, SingleFlight
+
+
+def test_that_concurrent_calls_share_one_call():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(True)
+        release.wait()
+        return "result"
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(flight.do, "key", fetch) for _ in range(4)]
+        # Give the other threads time to join the first call.
+        time.sleep(0.1)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert calls == [True]
+    assert results == ["result"] * 4
+
+
+def test_that_a_finished_call_is_not_reused():
+    flight = SingleFlight()
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2
+
+
+def test_that_an_exception_is_raised_and_the_key_released():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        flight.do("key", fail)
+    assert flight.do("key", lambda: 1) == 1
+
+
+@pytest.mark.asyncio
+async def test_that_concurrent_tasks_share_one_call():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fetch(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key
+
+    results = await asyncio.gather(
+        *(flight.do(key, lambda key=key: fetch(key)) for key in ["a", "a", "b", "a"])
+    )
+    assert sorted(calls) == ["a", "b"]
+    assert results == ["a", "a", "b", "a"]
+
+
+@pytest.mark.asyncio
+async def test_that_cancelling_a_caller_does_not_cancel_the_call():
+    flight = AsyncSingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        return "result"
+
+    first = asyncio.create_task(flight.do("key", fetch))
+    second = asyncio.create_task(flight.do("key", fetch))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == "result"
+
+
+@pytest.mark.asyncio
+async def test_that_cancelling_every_caller_cancels_the_call():
+    flight = AsyncSingleFlight()
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def fetch():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return "stale"
+
+    callers = [asyncio.create_task(flight.do("key", fetch)) for _ in range(2)]
+    await started.wait()
+    for caller in callers:
+        caller.cancel()
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+
+    # A later caller makes a new call instead of joining the cancelled one.
+    async def fresh():
+        return "fresh"
+
+    assert await flight.do("key", fresh) == "fresh"
@@ -0,0 +1,111 @@
+import pytest
+from PIL import Image
+
+import streetview.tools
+from streetview.tools import (
+    BLACK_LUMINANCE,
+    clear_sampling_maps,
+    crop_bottom_and_right_black_border,
+    get_sampling_map,
+    reproject_cubemap,
+    reproject_perspective,
+    reproject_perspectives,
+)
+from streetview.view import make_view_sampler
+
+
+def test_that_the_bottom_and_right_border_is_cropped():
+    image = Image.new("RGB", (100, 50))
+    image.paste((200, 200, 200), (0, 0, 70, 30))
+    # Only just brighter than black, so it is kept.
+    image.putpixel((80, 10), (BLACK_LUMINANCE + 1,) * 3)
+    assert crop_bottom_and_right_black_border(image).size == (81, 30)
+
+
+def test_that_an_image_without_a_border_is_untouched():
+    image = Image.new("RGB", (100, 50), (200, 200, 200))
+    assert crop_bottom_and_right_black_border(image) is image
+
+
+def test_that_an_all_black_image_is_untouched():
+    image = Image.new("RGB", (100, 50), (BLACK_LUMINANCE,) * 3)
+    assert crop_bottom_and_right_black_border(image) is image
+
+
+def make_panorama(colors: list[str], width: int = 64, height: int = 32) -> Image.Image:
+    """
+    Returns a panorama in vertical stripes of `colors`, left to right.
+    """
+    panorama = Image.new("RGB", (width, height))
+    stripe = width // len(colors)
+    for i, color in enumerate(colors):
+        panorama.paste(color, (i * stripe, 0, (i + 1) * stripe, height))
+    return panorama
+
+
+def test_that_views_are_cut_at_each_heading():
+    pytest.importorskip("numpy")
+    panorama = make_panorama(["red", "green", "blue", "yellow"])
+    views = reproject_perspectives(panorama, [-135, -45, 45, 135], fov=30, size=(8, 8))
+    assert [view.getpixel((4, 4)) for view in views] == [
+        (255, 0, 0),
+        (0, 128, 0),
+        (0, 0, 255),
+        (255, 255, 0),
+    ]
+
+
+def test_that_a_cubemap_has_six_faces():
+    pytest.importorskip("numpy")
+    panorama = Image.new("RGB", (64, 32), "green")
+    panorama.paste("blue", (0, 16, 64, 32))
+    faces = reproject_cubemap(panorama, face_size=16)
+    assert list(faces) == ["front", "right", "back", "left", "up", "down"]
+    assert all(face.size == (16, 16) for face in faces.values())
+    assert faces["up"].getpixel((8, 8)) == (0, 128, 0)
+    assert faces["down"].getpixel((8, 8)) == (0, 0, 255)
+
+
+def test_that_sampling_maps_are_cached():
+    pytest.importorskip("numpy")
+    first = get_sampling_map((64, 32), (8, 8), 90, 0, 10)
+    assert get_sampling_map((64, 32), (8, 8), 90, 0, 10) is first
+
+
+def test_that_a_heading_shifts_the_cached_map():
+    np = pytest.importorskip("numpy")
+    rng = np.random.default_rng(0)
+    panorama = rng.integers(0, 256, size=(32, 64, 3), dtype=np.uint8)
+    # 45 degrees is 8 columns of a 64 pixel wide panorama.
+    turned = get_sampling_map((64, 32), (8, 8), 90, 45, 10).apply(panorama)
+    rolled = np.roll(panorama, -8, axis=1)
+    expected = get_sampling_map((64, 32), (8, 8), 90, 0, 10).apply(rolled)
+    assert np.array_equal(turned, expected)
+
+
+def test_that_the_sampling_map_cache_is_bounded_by_bytes(monkeypatch):
+    pytest.importorskip("numpy")
+    clear_sampling_maps()
+    size = get_sampling_map((64, 32), (8, 8), 90).nbytes
+    monkeypatch.setattr(streetview.tools, "SAMPLING_MAP_CACHE_BYTES", size)
+    get_sampling_map((64, 32), (8, 8), 80)
+    assert list(streetview.tools._sampling_maps) == [((64, 32), (8, 8), 80, 0)]
+    clear_sampling_maps()
+
+
+def test_that_a_reprojection_matches_a_view_rendered_from_tiles():
+    np = pytest.importorskip("numpy")
+    rng = np.random.default_rng(0)
+    panorama = rng.integers(0, 256, size=(512, 1024, 3), dtype=np.uint8)
+    sampler = make_view_sampler(heading=135, pitch=20, fov=100, size=(32, 24), zoom=1)
+    tiles = {
+        (x, y): Image.fromarray(panorama[:, x * 512 : (x + 1) * 512])
+        for x, y in sampler.tiles
+    }
+    expected = np.asarray(sampler.render(tiles))
+    view = reproject_perspective(
+        panorama, heading=135, pitch=20, fov=100, size=(32, 24)
+    )
+    # The reprojection turns a heading 0 map, float rounding can differ by one.
+    difference = np.abs(np.asarray(view).astype(int) - expected.astype(int))
+    assert difference.max() <= 1
@@ -0,0 +1,63 @@
+import pytest
+from PIL import Image
+
+from streetview import get_panorama_view, get_panorama_view_async
+from streetview.tools import perspective_to_equirectangular
+from streetview.view import make_view_sampler, pick_view_zoom
+
+np = pytest.importorskip("numpy")
+
+
+def test_that_the_middle_of_the_view_is_the_heading():
+    u, v = perspective_to_equirectangular(heading=90, pitch=0, fov=90, size=(3, 3))
+    assert u[1, 1] == pytest.approx(0.75)
+    assert v[1, 1] == pytest.approx(0.5)
+
+
+def test_that_looking_up_moves_towards_the_top():
+    _, v = perspective_to_equirectangular(heading=0, pitch=45, fov=90, size=(3, 3))
+    assert v[1, 1] == pytest.approx(0.25)
+
+
+def test_that_a_view_across_the_seam_wraps_around():
+    u, _ = perspective_to_equirectangular(heading=180, pitch=0, fov=90, size=(64, 1))
+    assert u.min() < 0.2
+    assert u.max() > 0.8
+
+
+@pytest.mark.parametrize("fov, zoom", [(90, 2), (30, 4), (5, 5)])
+def test_that_the_view_zoom_is_sharp_enough(fov: float, zoom: int):
+    assert pick_view_zoom(fov, width=640) == zoom
+
+
+def test_that_a_view_is_rendered_from_its_tiles():
+    tiles = {
+        (0, 0): Image.new("RGB", (512, 512), "red"),
+        (1, 0): Image.new("RGB", (512, 512), "blue"),
+    }
+    sampler = make_view_sampler(heading=-45, pitch=0, fov=30, size=(8, 8), zoom=1)
+    assert sampler.tiles == [(0, 0)]
+    view = sampler.render(tiles)
+    assert view.size == (8, 8)
+    assert view.getpixel((4, 4)) == (255, 0, 0)
+
+    sampler = make_view_sampler(heading=45, pitch=0, fov=30, size=(8, 8), zoom=1)
+    assert sampler.render(tiles).getpixel((4, 4)) == (0, 0, 255)
+
+
+@pytest.mark.vcr()
+def test_that_a_view_only_downloads_the_tiles_it_needs(vcr_cassette):
+    view = get_panorama_view(
+        "qtpYC28QnAbluW4jTNNjSg", heading=-45, fov=60, size=(64, 48), zoom=1
+    )
+    assert view.size == (64, 48)
+    assert vcr_cassette.play_count == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.vcr()
+async def test_that_a_view_renders_async():
+    view = await get_panorama_view_async(
+        "qtpYC28QnAbluW4jTNNjSg", heading=180, fov=60, size=(64, 48), zoom=1
+    )
+    assert view.size == (64, 48)